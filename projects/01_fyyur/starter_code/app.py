@@ -3,18 +3,34 @@
 #----------------------------------------------------------------------------#
 
 import json
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import click
+from itertools import chain, groupby
+from types import SimpleNamespace
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+from flask import Blueprint, Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, make_response, stream_with_context, get_flashed_messages
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_
+from sqlalchemy import DDL, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
-import sys
+from cache import DetailCache, RowCache
+from events import EventBus, sse_stream
+from listing import CappedRows
+from search import ModelSearch
+from scheduling import CALENDAR_VIEWS, calendar_range, free_slots, ical_calendar
+from routing import RoutingSQLAlchemy
+from instrumentation import RotatingLogFileHandler, RouteMetrics, instrument_requests, start_queue_logging
+import importer
+import recommend
+import hmac
+import io
+import os
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -22,9 +38,16 @@ import sys
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app, session_options={"expire_on_commit": False})
+db = RoutingSQLAlchemy(app, session_options={"expire_on_commit": False})
 
 migrate = Migrate(app, db)
+detail_cache = DetailCache(app.config['DETAIL_CACHE_SIZE'],
+  app.config['REPLICA_STICKY_SECONDS'] if app.config['SQLALCHEMY_REPLICA_URIS'] else 0)
+row_cache = RowCache(app.config['ROW_CACHE_SIZE'], app.config['ROW_CACHE_SECONDS'],
+  app.config['REPLICA_STICKY_SECONDS'] if app.config['SQLALCHEMY_REPLICA_URIS'] else 0)
+show_events = EventBus(app.config['SHOW_EVENTS_QUEUE_SIZE'])
+route_metrics = RouteMetrics()
+instrument_requests(app, route_metrics, app.logger)
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
@@ -38,7 +61,7 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.Column(db.Text)
     facebook_link = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     website_link = db.Column(db.String(120))
@@ -46,8 +69,10 @@ class Venue(db.Model):
     seeking_description = db.Column(db.String(500))
     upcoming_shows = db.relationship('Show', backref='venue_upcoming', lazy=True)
     past_shows = db.relationship('Show', backref='venue_past', lazy=True)
-    upcoming_shows_count = db.Column(db.Integer)
-    past_shows_count = db.Column(db.Integer)
+    genre_list = db.relationship('Genre', secondary='venue_genres', lazy=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    upcoming_shows_count = db.Column(db.Integer, default=0)
+    past_shows_count = db.Column(db.Integer, default=0)
     
 
 class Artist(db.Model):
@@ -58,7 +83,7 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.Column(db.Text)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website_link = db.Column(db.String(120))
@@ -66,24 +91,353 @@ class Artist(db.Model):
     seeking_description = db.Column(db.String(500))
     upcoming_shows = db.relationship('Show', backref='artist_upcoming', lazy=True)
     past_shows = db.relationship('Show', backref='artist_past', lazy=True)
-    upcoming_shows_count = db.Column(db.Integer)
-    past_shows_count = db.Column(db.Integer)
+    genre_list = db.relationship('Genre', secondary='artist_genres', lazy=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    upcoming_shows_count = db.Column(db.Integer, default=0)
+    past_shows_count = db.Column(db.Integer, default=0)
+
+
+def show_duration():
+  return timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+
+def default_show_end_time(context):
+  return context.get_current_parameters()['start_time'] + show_duration()
 
 
 class Show(db.Model):
     __tablename__='Show'
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False, default=default_show_end_time)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Let PostgreSQL reject overlapping bookings of a venue or an artist also when
+# the tables are made by create_all(); migration f6c1b54a95cf adds the same.
+db.event.listen(Show.__table__, 'before_create',
+  DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+for column in ('venue_id', 'artist_id'):
+  db.event.listen(Show.__table__, 'after_create', DDL(
+    'ALTER TABLE "Show" ADD CONSTRAINT "Show_{0}_no_overlap" '
+    'EXCLUDE USING gist ({0} WITH =, tsrange(start_time, end_time) WITH &&)'.format(column)).
+    execute_if(dialect='postgresql'))
+
+
+class ShowArchive(db.Model):
+    """Past shows moved out of Show by the archive-shows command.
+
+    Keeps the ids the shows had in Show. On PostgreSQL the table is range
+    partitioned by start_time, one partition per year; partitions are
+    created by archive_shows() as needed.
+    """
+    __tablename__ = 'ShowArchive'
+    __table_args__ = (
+        db.Index('ix_ShowArchive_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_ShowArchive_artist_id_start_time', 'artist_id', 'start_time'),
+        {'postgresql_partition_by': 'RANGE (start_time)'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    start_time = db.Column(db.DateTime, primary_key=True)
+    end_time = db.Column(db.DateTime, nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    updated_at = db.Column(db.DateTime)
+
+
+# Columns Show and ShowArchive have in common.
+SHOW_COLUMNS = ('id', 'start_time', 'end_time', 'venue_id', 'artist_id', 'updated_at')
+
+def show_source(include_archive=False, where=None):
+  """Return the Show table, or its union with ShowArchive, to select shows from.
+
+  ``where(table)`` narrows both halves of the union, so they can be read
+  through their indexes; the caller still filters the result itself.
+  """
+  if not include_archive:
+    return Show.__table__
+  selects = []
+  for table in (Show.__table__, ShowArchive.__table__):
+    select = db.select([table.c[name] for name in SHOW_COLUMNS])
+    selects.append(select.where(where(table)) if where is not None else select)
+  return db.union_all(*selects).subquery('all_shows')
+
+def archive_horizon(now=None):
+  """Shows starting before this time may have been archived."""
+  return (now or datetime.now()) - timedelta(days=app.config['SHOW_ARCHIVE_AFTER_DAYS'])
+
+
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+
+
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id', 'genre_id', 'venue_id')
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id', 'genre_id', 'artist_id')
+)
+
+class ShowMonthCount(db.Model):
+    """Number of shows per month of one venue, artist or city.
+
+    ``key`` is the venue or artist id, or "<state>|<city>" for cities; see
+    month_count_key(). Maintained together with the stored show counters.
+    """
+    __tablename__ = 'ShowMonthCount'
+
+    scope = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(250), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Recommendation(db.Model):
+    """Precomputed similar venues of a venue, or similar artists of an artist.
+
+    Rows are written by the build-recommendations command, ``rank`` 0 being
+    the most similar ``other_id``.
+    """
+    __tablename__ = 'Recommendation'
+
+    kind = db.Column(db.String(10), primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+
+# Association table and its entity column per model.
+GENRE_LINKS = {
+  Venue: (venue_genres, venue_genres.c.venue_id),
+  Artist: (artist_genres, artist_genres.c.artist_id),
+}
+
+def parse_genres(value):
+  """Split a stored genres value, e.g. "Jazz,Soul" or "{Jazz,\"R&B\"}"."""
+  genres = []
+  for genre in (value or '').strip('{}').split(','):
+    genre = genre.strip().strip('"').strip()
+    if genre and genre not in genres:
+      genres.append(genre)
+  return genres
+
+def genre_ids(names):
+  """Return a name -> id dict for ``names``, creating missing Genre rows."""
+  ids = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)))
+  missing = [name for name in names if name not in ids]
+  if missing:
+    db.session.execute(Genre.__table__.insert(), [{'name': name} for name in missing])
+    ids.update(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(missing)))
+  return ids
+
+def genre_rows(names):
+  ids = genre_ids(names)
+  return Genre.query.filter(Genre.id.in_(ids.values())).all() if ids else []
+
+def link_genres(model, names):
+  """Create the genre links of the ``model`` rows with the given names."""
+  rows = db.session.query(model.id, model.genres).filter(model.name.in_(names)).all()
+  ids = genre_ids(set(genre for id, genres in rows for genre in parse_genres(genres)))
+  table, column = GENRE_LINKS[model]
+  links = [{column.name: id, 'genre_id': ids[genre]}
+    for id, genres in rows for genre in parse_genres(genres)]
+  if links:
+    db.session.execute(table.insert(), links)
+
+
+# Case-insensitive name lookups.
+db.Index('ix_Venue_lower_name', db.func.lower(Venue.name))
+db.Index('ix_Artist_lower_name', db.func.lower(Artist.name))
+
+def adjust_show_counters(connection, show, delta, now=None):
+  now = now or datetime.now()
+  if show.start_time > now:
+    column = 'upcoming_shows_count'
+  else:
+    column = 'past_shows_count'
+  for model, id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+    counter = getattr(model.__table__.c, column)
+    connection.execute(model.__table__.update().
+      where(model.__table__.c.id == id).
+      values({counter: db.func.coalesce(counter, 0) + delta}))
+
+def month_count_key(scope, id=None, city=None, state=None):
+  if scope == 'city':
+    return '{}|{}'.format(state, city)
+  return str(id)
+
+# Dialects whose INSERT supports ON CONFLICT upserts.
+DIALECT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+def adjust_month_counts(connection, show, delta):
+  """Add ``delta`` to the month counts of the show's venue, artist and city."""
+  city, state = connection.execute(
+    db.select([Venue.city, Venue.state]).where(Venue.id == show.venue_id)).first()
+  month = show.start_time.strftime('%Y-%m')
+  table = ShowMonthCount.__table__
+  for scope, key in (('venue', month_count_key('venue', show.venue_id)),
+      ('artist', month_count_key('artist', show.artist_id)),
+      ('city', month_count_key('city', city=city, state=state))):
+    row = {'scope': scope, 'key': key, 'month': month}
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+      insert = DIALECT_INSERTS[connection.dialect.name](table).values(count=delta, **row)
+      connection.execute(insert.on_conflict_do_update(
+        index_elements=['scope', 'key', 'month'],
+        set_={'count': table.c.count + delta}))
+    elif not connection.execute(table.update().
+        where(db.and_(*[table.c[name] == value for name, value in row.items()])).
+        values(count=table.c.count + delta)).rowcount:
+      connection.execute(table.insert().values(count=delta, **row))
+
+def show_month(dialect, start_time):
+  if dialect == 'postgresql':
+    return db.func.to_char(start_time, 'YYYY-MM')
+  return db.func.strftime('%Y-%m', start_time)
+
+def rebuild_month_counts(scope, keys=None):
+  """Recompute the month counts of ``scope`` for ``keys`` or all, archive included."""
+  table = ShowMonthCount.__table__
+  shows = show_source(include_archive=True)
+  month = show_month(db.session.connection().dialect.name, shows.c.start_time)
+  if scope == 'city':
+    key = Venue.state.concat('|').concat(Venue.city)
+    counts = db.select([db.literal(scope), key, month, db.func.count(shows.c.id)]).\
+      select_from(shows.join(Venue, shows.c.venue_id == Venue.id)).\
+      where(Venue.city.isnot(None)).where(Venue.state.isnot(None))
+    if keys is not None:
+      counts = counts.where(key.in_(keys))
+  else:
+    column = shows.c.venue_id if scope == 'venue' else shows.c.artist_id
+    key = db.cast(column, db.String)
+    counts = db.select([db.literal(scope), key, month, db.func.count(shows.c.id)])
+    if keys is not None:
+      counts = counts.where(column.in_([int(k) for k in keys]))
+  delete = table.delete().where(table.c.scope == scope)
+  if keys is not None:
+    delete = delete.where(table.c.key.in_([str(k) for k in keys]))
+  db.session.execute(delete)
+  db.session.execute(table.insert().from_select(['scope', 'key', 'month', 'count'],
+    counts.group_by(key, month)))
+
+@db.event.listens_for(Show, 'after_insert')
+def count_new_show(mapper, connection, show):
+  adjust_show_counters(connection, show, 1)
+  adjust_month_counts(connection, show, 1)
+
+@db.event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+  # The show may have started since it was counted, and until the next
+  # rollover it is still in the upcoming counter; recount instead of guessing.
+  now = datetime.now()
+  for model, id in ((Venue, show.venue_id), (Artist, show.artist_id)):
+    connection.execute(model.__table__.update().
+      where(model.__table__.c.id == id).values(show_counter_values(model, id, now)))
+  adjust_month_counts(connection, show, -1)
+
+def show_counter_values(model, id, now):
+  """Return the counter columns of ``model`` mapped to counts of the shows of ``id``."""
+  foreign_key = Show.venue_id if model is Venue else Show.artist_id
+  archived_foreign_key = ShowArchive.venue_id if model is Venue else ShowArchive.artist_id
+  shows = db.select([db.func.count(Show.id)]).where(foreign_key == id)
+  archived = db.select([db.func.count(ShowArchive.id)]).where(archived_foreign_key == id)
+  return {
+    model.__table__.c.upcoming_shows_count: shows.where(Show.start_time > now).scalar_subquery(),
+    model.__table__.c.past_shows_count: shows.where(Show.start_time <= now).scalar_subquery() +
+      archived.scalar_subquery()
+  }
+
+def refresh_show_counters(model, ids=None, now=None):
+  """Recompute the stored show counters of ``model`` rows from Show and ShowArchive.
+
+  ``ids`` may be a list or a select of ids; all rows are refreshed when it is
+  None. The update is idempotent, so overlapping refreshes are harmless.
+  """
+  query = db.session.query(model)
+  if ids is not None:
+    query = query.filter(model.id.in_(ids))
+  return query.update(show_counter_values(model, model.id, now or datetime.now()),
+    synchronize_session=False)
+
+
+# Relevance weights of the columns covered by venue and artist search.
+venue_search = ModelSearch(Venue, {'name': 4, 'city': 2, 'state': 1, 'genres': 1})
+artist_search = ModelSearch(Artist, {'name': 4, 'city': 2, 'state': 1, 'genres': 1})
+
+IMPORT_SPECS = {
+  'venues': importer.ImportSpec(Venue.__table__, VenueForm,
+    ['name', 'city', 'state', 'address', 'phone', 'genres', 'facebook_link',
+     'image_link', 'website_link', 'seeking_talent', 'seeking_description'],
+    derived={'updated_at': lambda values: datetime.utcnow()},
+    defaults={'upcoming_shows_count': 0, 'past_shows_count': 0}, unique='name'),
+  'artists': importer.ImportSpec(Artist.__table__, ArtistForm,
+    ['name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link',
+     'website_link', 'seeking_venue', 'seeking_description'],
+    derived={'updated_at': lambda values: datetime.utcnow()},
+    defaults={'upcoming_shows_count': 0, 'past_shows_count': 0}, unique='name'),
+  'shows': importer.ImportSpec(Show.__table__, ShowForm,
+    ['venue_id', 'artist_id', 'start_time'],
+    derived={'end_time': lambda values: values['start_time'] + show_duration(),
+      'updated_at': lambda values: datetime.utcnow()},
+    references={'venue_id': Venue.__table__, 'artist_id': Artist.__table__},
+    exclusion=importer.Exclusion(['venue_id', 'artist_id'], 'start_time', 'end_time',
+      timedelta(minutes=app.config['SHOW_MAX_DURATION_MINUTES']))),
+}
+
+#----------------------------------------------------------------------------#
+# Scheduling.
+#----------------------------------------------------------------------------#
+
+def overlapping_shows(column, id, start_time, end_time):
+  """Filter for shows with ``column == id`` overlapping [start_time, end_time).
+
+  No show lasts longer than SHOW_MAX_DURATION_MINUTES, so overlapping shows
+  must also start after ``start_time`` minus that duration. The extra bound
+  keeps the lookup inside a short range of the (id, start_time) index however
+  many past shows there are.
+  """
+  earliest = start_time - timedelta(minutes=app.config['SHOW_MAX_DURATION_MINUTES'])
+  return db.and_(column == id, Show.start_time > earliest,
+    Show.start_time < end_time, Show.end_time > start_time)
+
+def lock_bookings():
+  """Keep other bookings out until the session commits, where no constraint does.
+
+  PostgreSQL rejects overlapping shows itself. pysqlite only begins a
+  transaction before the first write, so another booking could be committed
+  between the conflict check and the insert; take SQLite's write lock first.
+  """
+  connection = db.session.connection()
+  if connection.dialect.name == 'sqlite' and not connection.connection.in_transaction:
+    connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def booking_conflicts(venue_id, artist_id, start_time, end_time):
+  return Show.query.filter(db.or_(
+    overlapping_shows(Show.venue_id, venue_id, start_time, end_time),
+    overlapping_shows(Show.artist_id, artist_id, start_time, end_time)
+  )).all()
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
+  date = value if isinstance(value, datetime) else dateutil.parser.parse(value)
   if format == 'full':
       format="EEEE MMMM, d, y 'at' h:mma"
   elif format == 'medium':
@@ -92,6 +446,186 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+static_fingerprints = {}
+
+def static_url(filename):
+  """Return the URL of a static file tagged with a hash of its content.
+
+  Tagged URLs change whenever the file does, so they are served with
+  far-future cache headers.
+  """
+  path = os.path.join(app.static_folder, filename)
+  try:
+    mtime = os.path.getmtime(path)
+  except OSError:
+    return url_for('static', filename=filename)
+  fingerprint = static_fingerprints.get(filename)
+  if fingerprint is None or fingerprint[0] != mtime:
+    with open(path, 'rb') as f:
+      fingerprint = (mtime, hashlib.md5(f.read()).hexdigest()[:12])
+    static_fingerprints[filename] = fingerprint
+  return url_for('static', filename=filename, v=fingerprint[1])
+
+app.jinja_env.globals['static_url'] = static_url
+
+@app.after_request
+def cache_fingerprinted_static(response):
+  if request.endpoint == 'static' and response.status_code == 200:
+    fingerprint = static_fingerprints.get(request.view_args.get('filename'))
+    if fingerprint and request.args.get('v') == fingerprint[1]:
+      response.cache_control.no_cache = None
+      response.cache_control.public = True
+      response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+      response.cache_control.immutable = True
+  return response
+
+#----------------------------------------------------------------------------#
+# Streamed rendering.
+#----------------------------------------------------------------------------#
+
+def stream_template(template_name, **context):
+  """Render a template as a stream of chunks, for Response(stream_with_context(...)).
+
+  Rows passed in the context are then fetched while the page is sent
+  instead of before. Flashed messages are read up front, while the session
+  can still be saved.
+  """
+  get_flashed_messages()
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(app.config['TEMPLATE_STREAM_BUFFER'])
+  return stream
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+def latest(*times):
+  times = [time for time in times if time is not None]
+  return max(times) if times else None
+
+def content_etag(data):
+  return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def conditional_response(etag, last_modified, render):
+  """Answer 304 if the client copy is current, else call ``render()``.
+
+  ``last_modified`` is a naive UTC datetime. Pages are marked no-cache so
+  clients revalidate them on every use.
+  """
+  if last_modified is not None:
+    last_modified = last_modified.replace(microsecond=0)
+  since = request.if_modified_since
+  if since is not None and since.tzinfo is not None:
+    since = since.astimezone(timezone.utc).replace(tzinfo=None)
+  if request.if_none_match:
+    fresh = request.if_none_match.contains_weak(etag)
+  else:
+    fresh = since is not None and last_modified is not None and last_modified <= since
+  response = Response(status=304) if fresh else make_response(render())
+  response.set_etag(etag, weak=True)
+  if last_modified is not None:
+    response.last_modified = last_modified
+  response.cache_control.no_cache = True
+  return response
+
+#----------------------------------------------------------------------------#
+# Cache invalidation.
+#----------------------------------------------------------------------------#
+
+def invalidate_venue_details(venue_id):
+  # artist pages list the names and images of the venues they played at
+  artist_ids = db.session.query(Show.artist_id).\
+    filter(Show.venue_id == venue_id).distinct()
+  detail_cache.invalidate(('venue', venue_id),
+    *[('artist', artist_id) for artist_id, in artist_ids])
+
+def invalidate_artist_details(artist_id):
+  venue_ids = db.session.query(Show.venue_id).\
+    filter(Show.artist_id == artist_id).distinct()
+  detail_cache.invalidate(('artist', artist_id),
+    *[('venue', venue_id) for venue_id, in venue_ids])
+
+#----------------------------------------------------------------------------#
+# Live updates.
+#----------------------------------------------------------------------------#
+
+def show_event_data(*criteria):
+  """Return the event data of the upcoming shows matching ``criteria``."""
+  rows = db.session.query(Show.id, Show.start_time, Show.end_time,
+      Venue.id, Venue.name, Venue.city, Venue.state,
+      Artist.id, Artist.name, Artist.image_link
+    ).join(Venue, Show.venue_id == Venue.id).\
+    join(Artist, Show.artist_id == Artist.id).\
+    filter(Show.start_time > datetime.now(), *criteria).\
+    order_by(Show.start_time, Show.id)
+  return [{
+      'id': id,
+      'start_time': start_time.isoformat(),
+      'end_time': end_time.isoformat(),
+      'venue_id': venue_id,
+      'venue_name': venue_name,
+      'city': city,
+      'state': state,
+      'artist_id': artist_id,
+      'artist_name': artist_name,
+      'artist_image_link': artist_image_link
+    } for id, start_time, end_time, venue_id, venue_name, city, state,
+      artist_id, artist_name, artist_image_link in rows]
+
+def publish_show_events(type, shows):
+  """Publish a ``created``, ``updated`` or ``deleted`` event per show data dict.
+
+  Call after the change is committed.
+  """
+  for data in shows:
+    show_events.publish(type, data)
+
+#----------------------------------------------------------------------------#
+# Row cache.
+#----------------------------------------------------------------------------#
+
+# Columns kept out of the row cache; they are changed by bulk statements
+# that bypass the session events below.
+ROW_CACHE_EXCLUDED = ('upcoming_shows_count', 'past_shows_count')
+
+def cached_row(model, id):
+  """Return the columns of a Venue or Artist row as read-only attributes, or None.
+
+  Reads through row_cache. The result is not attached to the session, so
+  load the row itself to change it.
+  """
+  key = (model.__tablename__, id)
+  values = row_cache.get(key)
+  if values is None:
+    generation = row_cache.generation
+    columns = [column for column in model.__table__.columns
+      if column.key not in ROW_CACHE_EXCLUDED]
+    row = db.session.query(*columns).filter(model.id == id).first()
+    if row is None:
+      return None
+    values = dict(zip([column.key for column in columns], row))
+    row_cache.set(key, values, generation)
+  return SimpleNamespace(**values)
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_cached_rows(session, flush_context):
+  # Rows are evicted once the change is committed; evicting them during the
+  # flush would let other requests cache the old row again before then.
+  session.info.setdefault('changed_rows', set()).update(
+    (target.__tablename__, target.id) for target in chain(session.dirty, session.deleted)
+    if isinstance(target, (Venue, Artist)))
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_cached_rows(session):
+  keys = session.info.pop('changed_rows', None)
+  if keys:
+    row_cache.invalidate(*keys)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_cached_rows(session):
+  session.info.pop('changed_rows', None)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -104,50 +638,119 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+def venue_directory():
+  """Yield the /venues areas from one query over the Venue table.
+
+  Upcoming show counts are read from the stored counters. Rows come back
+  ordered by state/city, so each area can be emitted as soon as its last
+  venue has been read instead of materializing the whole table.
+  """
+  rows = db.session.query(
+      Venue.state, Venue.city, Venue.id, Venue.name,
+      db.func.coalesce(Venue.upcoming_shows_count, 0).label('num_upcoming_shows')
+    ).order_by(Venue.state, Venue.city, Venue.name, Venue.id).\
+    yield_per(1000)
+
+  for (state, city), group in groupby(rows, key=lambda row: (row.state, row.city)):
+    yield {
+      'city': city,
+      'state': state,
+      'venues': [{
+          'id': row.id,
+          'name': row.name,
+          'num_upcoming_shows': row.num_upcoming_shows
+      } for row in group]
+    }
+
 @app.route('/venues')
 def venues():
-  locals = []
-  venues = Venue.query.all()
-  places = Venue.query.distinct(Venue.city, Venue.state).all()
-	
-  for place in places:
-    locals.append({
-        'city': place.city,
-        'state': place.state,
-        'venues': [{
-            'id': venue.id,
-            'name': venue.name,
-            'num_upcoming_shows': len([show for show in venue.upcoming_shows if show.start_time > datetime.now()])
-        } for venue in venues if
-            venue.city == place.city and venue.state == place.state]
-    })
-  return render_template('pages/venues.html', areas=locals)
-
-@app.route('/venues/search', methods=['POST'])
+  return render_template('pages/venues.html', areas=venue_directory())
+
+def search_page(model_search, template):
+  search_term = request.values.get('search_term', '')
+  page = max(request.values.get('page', 1, type=int), 1)
+  per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+  total, data = model_search.search(db.session, search_term, per_page, (page - 1) * per_page)
+  response = {
+    "count": total,
+    "data": data,
+    "page": page,
+    "has_next": page * per_page < total
+  }
+
+  return render_template(template, results=response, search_term=search_term)
+
+def search_suggestions(model_search):
+  suggestions = model_search.suggest(db.session, request.args.get('q', ''),
+    app.config['SEARCH_SUGGESTIONS'])
+  return jsonify([{'id': id, 'name': name} for id, name in suggestions])
+
+@app.route('/venues/search', methods=['GET', 'POST'])
 def search_venues():
-  search_term = request.form['search_term']
-  response = Venue.query.filter(Venue.name.ilike('%{}%'.format(search_term))).all()
-  response={"data": response}
+  return search_page(venue_search, 'pages/search_venues.html')
 
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+@app.route('/venues/search/suggest')
+def suggest_venues():
+  return search_suggestions(venue_search)
 
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-  venue = Venue.query.get(venue_id)
-
-  past_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-    filter(
-        Show.venue_id == venue_id,
-        Show.artist_id == Artist.id,
-        Show.start_time < datetime.now()
-    ).all()
-
-  upcoming_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-    filter(
-        Show.venue_id == venue_id,
-        Show.artist_id == Artist.id,
-        Show.start_time > datetime.now()
-    ).all()
+def recommendations(kind, id):
+  """Return the stored similar venues or artists of a venue or artist, best first."""
+  model = Venue if kind == 'venue' else Artist
+  rows = db.session.query(model.id, model.name, model.image_link).\
+    join(Recommendation, Recommendation.other_id == model.id).\
+    filter(Recommendation.kind == kind, Recommendation.id == id).\
+    order_by(Recommendation.rank)
+  return [{'id': other_id, 'name': name, 'image_link': image_link}
+    for other_id, name, image_link in rows]
+
+def archived_count(foreign_key, id_column, include_archive):
+  if include_archive:
+    return db.literal(0)
+  return db.select([db.func.count(ShowArchive.id)]).\
+    where(foreign_key == id_column).scalar_subquery()
+
+def venue_detail(venue_id, now=None, include_archive=False):
+  """Load a venue and its shows with one query and split them in one pass.
+
+  Returns the page data and the start time of the earliest upcoming show,
+  after which the past/upcoming split is stale, or (None, None) if there is
+  no such venue. The data carries an ETag of its content and the latest
+  update time of the rows it was built from. Archived shows are only listed
+  with ``include_archive``; otherwise just their number is read.
+  """
+  now = now or datetime.now()
+  shows = show_source(include_archive, lambda table: table.c.venue_id == venue_id)
+  rows = db.session.query(
+      Venue, shows.c.start_time, shows.c.updated_at,
+      Artist.id, Artist.name, Artist.image_link, Artist.updated_at,
+      archived_count(ShowArchive.venue_id, Venue.id, include_archive)
+    ).outerjoin(shows, shows.c.venue_id == Venue.id).\
+    outerjoin(Artist, shows.c.artist_id == Artist.id).\
+    filter(Venue.id == venue_id).all()
+  if not rows:
+    return None, None
+
+  venue = rows[0][0]
+  archived_shows_count = rows[0][-1]
+  past_shows = []
+  upcoming_shows = []
+  expires_at = None
+  last_modified = venue.updated_at
+  for _, start_time, show_updated_at, artist_id, artist_name, artist_image_link, artist_updated_at, _ in rows:
+    if start_time is None:
+      continue
+    last_modified = latest(last_modified, show_updated_at, artist_updated_at)
+    show = {
+        'artist_id': artist_id,
+        'artist_image_link': artist_image_link,
+        'artist_name': artist_name,
+        'start_time': str(start_time)
+    }
+    if start_time > now:
+      upcoming_shows.append(show)
+      expires_at = start_time if expires_at is None else min(expires_at, start_time)
+    else:
+      past_shows.append(show)
 
   data = {
         'id': venue.id,
@@ -162,23 +765,43 @@ def show_venue(venue_id):
         'seeking_talent': venue.seeking_talent,
         'seeking_description': venue.seeking_description,
         'image_link': venue.image_link,
-        'past_shows': [{
-            'artist_id': artist.id,
-            'artist_image_link': artist.image_link,
-            'artist_name': artist.name,
-            'start_time': str(show.start_time)
-        } for artist, show in past_shows],
-        'upcoming_shows': [{
-            'artist_id': artist.id,
-            'artist_image_link': artist.image_link,
-            'artist_name': artist.name,
-            'start_time': str(show.start_time)
-        } for artist, show in upcoming_shows],
-        'past_shows_count': len(past_shows),
-        'upcoming_shows_count': len(upcoming_shows)
+        'past_shows': past_shows,
+        'upcoming_shows': upcoming_shows,
+        'past_shows_count': len(past_shows) + archived_shows_count,
+        'upcoming_shows_count': len(upcoming_shows),
+        'archived_shows_count': archived_shows_count,
+        'similar_venues': recommendations('venue', venue.id)
     }
+  data['etag'] = content_etag(data)
+  data['last_modified'] = last_modified
+  return data, expires_at
 
-  return render_template('pages/show_venue.html', venue=data)
+def cached_detail(kind, id, include_archive=False):
+  """Return the detail data of a venue or artist, cached until it expires.
+
+  Pages listing archived shows are rarely asked for and not cached.
+  """
+  load = venue_detail if kind == 'venue' else artist_detail
+  if include_archive:
+    data, expires_at = load(id, include_archive=True)
+    if data is None:
+      abort(404)
+    return data
+  data = detail_cache.get((kind, id))
+  if data is None:
+    data, expires_at = load(id)
+    if data is None:
+      abort(404)
+    # bounded, so rows written by other processes (recommendations) show up
+    max_expiry = datetime.now() + timedelta(seconds=app.config['DETAIL_CACHE_SECONDS'])
+    detail_cache.set((kind, id), data, min(expires_at or max_expiry, max_expiry))
+  return data
+
+@app.route('/venues/<int:venue_id>')
+def show_venue(venue_id):
+  data = cached_detail('venue', venue_id, request.args.get('archived') == '1')
+  return conditional_response(data['etag'], data['last_modified'],
+    lambda: render_template('pages/show_venue.html', venue=data))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -193,7 +816,7 @@ def create_venue_form():
 def create_venue_submission():
   error = False
   name =  request.form['name']
-  genres = request.form['genres']
+  genres = ','.join(request.form.getlist('genres'))
   address = request.form['address']
   city = request.form['city']
   state = request.form['state']
@@ -214,13 +837,14 @@ def create_venue_submission():
     venue = Venue(name=name, genres=genres, address=address, city=city, state=state, phone=phone, website_link=website_link, 
     facebook_link=facebook_link, image_link=image_link, seeking_talent=seeking_talent, seeking_description=None)
   try:
+    venue.genre_list = genre_rows(parse_genres(genres))
     db.session.add(venue)
     db.session.commit()
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not list venue %s', venue.name)
     flash('An error occurred. Venue ' + venue.name + ' could not be listed.')
   finally:
     db.session.close()
@@ -230,14 +854,38 @@ def create_venue_submission():
     return render_template('pages/home.html')
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
+  error = False
+  venue = db.session.query(Venue.city, Venue.state).filter(Venue.id == venue_id).first()
+  if venue is None:
+    abort(404)
   try:
-    venue = Venue.query.get(venue_id)
-    db.session.delete(venue)
+    deleted_shows = show_event_data(Show.venue_id == venue_id)
+    # delete the venue's shows and genre links with set-based statements
+    # instead of loading them, then refresh what was derived from them
+    artist_ids = set()
+    for model in (Show, ShowArchive):
+      artist_ids.update(id for id, in db.session.query(model.artist_id).
+        filter(model.venue_id == venue_id).distinct())
+      db.session.query(model).filter(model.venue_id == venue_id).\
+        delete(synchronize_session=False)
+    db.session.execute(venue_genres.delete().where(venue_genres.c.venue_id == venue_id))
+    db.session.query(Recommendation).\
+      filter(Recommendation.kind == 'venue', Recommendation.id == venue_id).\
+      delete(synchronize_session=False)
+    db.session.query(Venue).filter(Venue.id == venue_id).delete(synchronize_session=False)
+    refresh_show_counters(Artist, artist_ids)
+    rebuild_month_counts('venue', [venue_id])
+    rebuild_month_counts('artist', artist_ids)
+    rebuild_month_counts('city', [month_count_key('city', city=venue.city, state=venue.state)])
     db.session.commit()
+    row_cache.invalidate(('Venue', venue_id))
+    detail_cache.invalidate(('venue', venue_id), *[('artist', id) for id in artist_ids])
+    publish_show_events('deleted', deleted_shows)
   except:
     db.session.rollback()
+    app.logger.exception('Could not delete venue %s', venue_id)
     error = True
   finally:
     db.session.close()
@@ -251,35 +899,57 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  data = Artist.query.all()
-
-  return render_template('pages/artists.html', artists=data)
+  # streamed in id order, LISTING_MAX_ROWS at a time
+  limit = app.config['LISTING_MAX_ROWS']
+  rows = db.session.query(Artist.id, Artist.name).\
+    filter(Artist.id > request.args.get('after', 0, type=int)).\
+    order_by(Artist.id).limit(limit + 1).yield_per(500)
+  data = CappedRows(rows, limit, lambda row: row.id)
+  return Response(stream_with_context(stream_template('pages/artists.html', artists=data)))
 
-@app.route('/artists/search', methods=['POST'])
+@app.route('/artists/search', methods=['GET', 'POST'])
 def search_artists():
-  search_term = request.form['search_term']
-  response = Artist.query.filter(Artist.name.ilike('%{}%'.format(search_term))).all()
-  response={"data": response}
+  return search_page(artist_search, 'pages/search_artists.html')
 
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+@app.route('/artists/search/suggest')
+def suggest_artists():
+  return search_suggestions(artist_search)
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-  artist = Artist.query.get(artist_id)
-
-  past_shows = db.session.query(Venue, Show).join(Show).join(Artist).\
-    filter(
-        Show.venue_id == Venue.id,
-        Show.artist_id == artist.id,
-        Show.start_time < datetime.now()
-    ).all()
-
-  upcoming_shows = db.session.query(Venue, Show).join(Show).join(Artist).\
-    filter(
-        Show.venue_id == Venue.id,
-        Show.artist_id == artist.id,
-        Show.start_time > datetime.now()
-    ).all()
+def artist_detail(artist_id, now=None, include_archive=False):
+  """Artist counterpart of venue_detail()."""
+  now = now or datetime.now()
+  shows = show_source(include_archive, lambda table: table.c.artist_id == artist_id)
+  rows = db.session.query(
+      Artist, shows.c.start_time, shows.c.updated_at,
+      Venue.id, Venue.name, Venue.image_link, Venue.updated_at,
+      archived_count(ShowArchive.artist_id, Artist.id, include_archive)
+    ).outerjoin(shows, shows.c.artist_id == Artist.id).\
+    outerjoin(Venue, shows.c.venue_id == Venue.id).\
+    filter(Artist.id == artist_id).all()
+  if not rows:
+    return None, None
+
+  artist = rows[0][0]
+  archived_shows_count = rows[0][-1]
+  past_shows = []
+  upcoming_shows = []
+  expires_at = None
+  last_modified = artist.updated_at
+  for _, start_time, show_updated_at, venue_id, venue_name, venue_image_link, venue_updated_at, _ in rows:
+    if start_time is None:
+      continue
+    last_modified = latest(last_modified, show_updated_at, venue_updated_at)
+    show = {
+        'venue_id': venue_id,
+        'venue_image_link': venue_image_link,
+        'venue_name': venue_name,
+        'start_time': str(start_time)
+    }
+    if start_time > now:
+      upcoming_shows.append(show)
+      expires_at = start_time if expires_at is None else min(expires_at, start_time)
+    else:
+      past_shows.append(show)
 
   data = {
         'id': artist.id,
@@ -293,29 +963,30 @@ def show_artist(artist_id):
         'seeking_venue': artist.seeking_venue,
         'seeking_description': artist.seeking_description,
         'image_link': artist.image_link,
-        'past_shows': [{
-            'venue_id': venue.id,
-            'venue_image_link': venue.image_link,
-            'venue_name': venue.name,
-            'start_time': str(show.start_time)
-        } for venue, show in past_shows],
-        'upcoming_shows': [{
-            'venue_id': venue.id,
-            'venue_image_link': venue.image_link,
-            'venue_name': venue.name,
-            'start_time': str(show.start_time)
-        } for venue, show in upcoming_shows],
-        'past_shows_count': len(past_shows),
-        'upcoming_shows_count': len(upcoming_shows)
+        'past_shows': past_shows,
+        'upcoming_shows': upcoming_shows,
+        'past_shows_count': len(past_shows) + archived_shows_count,
+        'upcoming_shows_count': len(upcoming_shows),
+        'archived_shows_count': archived_shows_count,
+        'similar_artists': recommendations('artist', artist.id)
     }
+  data['etag'] = content_etag(data)
+  data['last_modified'] = last_modified
+  return data, expires_at
 
-  return render_template('pages/show_artist.html', artist=data)
+@app.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+  data = cached_detail('artist', artist_id, request.args.get('archived') == '1')
+  return conditional_response(data['etag'], data['last_modified'],
+    lambda: render_template('pages/show_artist.html', artist=data))
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  artist = Artist.query.get(artist_id)
+  artist = cached_row(Artist, artist_id)
+  if artist is None:
+    abort(404)
   form = ArtistForm(obj=artist)
   
   return render_template('forms/edit_artist.html', form=form, artist=artist)
@@ -324,7 +995,7 @@ def edit_artist(artist_id):
 def edit_artist_submission(artist_id):
   error = False
   name =  request.form['name']
-  genres = request.form['genres']
+  genres = ','.join(request.form.getlist('genres'))
   city = request.form['city']
   state = request.form['state']
   phone = request.form['phone']
@@ -345,6 +1016,7 @@ def edit_artist_submission(artist_id):
     a = db.session.query(Artist).get(artist_id)
     a.name = name
     a.genres = genres
+    a.genre_list = genre_rows(parse_genres(genres))
     a.city = city
     a.state = state
     a.phone = phone
@@ -354,11 +1026,13 @@ def edit_artist_submission(artist_id):
     a.seeking_description = seeking_description
     a.image_link = image_link
     db.session.commit()
+    invalidate_artist_details(artist_id)
+    publish_show_events('updated', show_event_data(Show.artist_id == artist_id))
     flash('Artist ' + name + ' was successfully updated!')
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not update artist %s', artist_id)
     flash('An error occurred. Artist ' + name + ' could not be updated.')
   finally:
     db.session.close()
@@ -369,7 +1043,9 @@ def edit_artist_submission(artist_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  venue = Venue.query.get(venue_id)
+  venue = cached_row(Venue, venue_id)
+  if venue is None:
+    abort(404)
   form = VenueForm(obj=venue)
 
   return render_template('forms/edit_venue.html', form=form, venue=venue)
@@ -378,7 +1054,7 @@ def edit_venue(venue_id):
 def edit_venue_submission(venue_id):
   error = False
   name =  request.form['name']
-  genres = request.form['genres']
+  genres = ','.join(request.form.getlist('genres'))
   city = request.form['city']
   state = request.form['state']
   adress = request.form['address']
@@ -398,8 +1074,13 @@ def edit_venue_submission(venue_id):
     seeking_description = None
   try:
     v = db.session.query(Venue).get(venue_id)
+    moved = (v.city, v.state) != (city, state)
+    old_city_key = month_count_key('city', city=v.city, state=v.state)
+    # subscribers of the old city see the venue's shows leave it
+    moved_shows = show_event_data(Show.venue_id == venue_id) if moved else []
     v.name = name
     v.genres = genres
+    v.genre_list = genre_rows(parse_genres(genres))
     v.city = city
     v.state = state
     v.phone = phone
@@ -408,12 +1089,18 @@ def edit_venue_submission(venue_id):
     v.seeking_talent = seeking_talent
     v.seeking_description = seeking_description
     v.image_link = image_link
+    if moved:
+      db.session.flush()
+      rebuild_month_counts('city', [old_city_key, month_count_key('city', city=city, state=state)])
     db.session.commit()
+    invalidate_venue_details(venue_id)
+    publish_show_events('deleted', moved_shows)
+    publish_show_events('updated', show_event_data(Show.venue_id == venue_id))
     flash('Venue ' + name + ' was successfully updated!')
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not update venue %s', venue_id)
     flash('An error occurred. Venue ' + name + ' could not be updated.')
   finally:
     db.session.close()
@@ -434,7 +1121,7 @@ def create_artist_form():
 def create_artist_submission():
   error = False
   name =  request.form['name']
-  genres = request.form['genres']
+  genres = ','.join(request.form.getlist('genres'))
   city = request.form['city']
   state = request.form['state']
   phone = request.form['phone']
@@ -454,13 +1141,14 @@ def create_artist_submission():
     artist = Artist(name=name, genres=genres, city=city, state=state, phone=phone, website_link=website_link, 
     facebook_link=facebook_link, image_link=image_link, seeking_venue=seeking_venue, seeking_description=None)
   try:
+    artist.genre_list = genre_rows(parse_genres(genres))
     db.session.add(artist)
     db.session.commit()
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not list artist %s', artist.name)
     flash('An error occurred. Artist ' + artist.name + ' could not be listed.')
   finally:
     db.session.close()
@@ -472,22 +1160,82 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+def encode_show_cursor(start_time, show_id):
+  return '{}_{}'.format(start_time.isoformat(), show_id)
+
+def decode_show_cursor(cursor):
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    return dateutil.parser.parse(start_time), int(show_id)
+  except (ValueError, OverflowError):
+    abort(400)
+
+def shows_query():
+  """Query shows joined to the listed venue and artist columns."""
+  return db.session.query(
+      Show.id, Show.start_time,
+      Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+      Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      Show.updated_at, Venue.updated_at.label('venue_updated_at'),
+      Artist.updated_at.label('artist_updated_at')
+    ).join(Venue, Show.venue_id == Venue.id).\
+    join(Artist, Show.artist_id == Artist.id)
+
+def shows_page(cursor=None, limit=None):
+  """Query one page of shows, plus the row after it, ordered by (start_time, id) descending.
+
+  Shows, venues and artists are fetched by a single joined query projecting
+  only the listed columns and their update times. Paging continues from the
+  (start_time, id) of the last row seen, so deep pages cost the same index
+  range scan as the first.
+  """
+  query = shows_query()
+  if cursor:
+    query = query.filter(db.tuple_(Show.start_time, Show.id) < decode_show_cursor(cursor))
+  return query.order_by(Show.start_time.desc(), Show.id.desc()).limit(limit + 1)
+
+def shows_page_version(page):
+  """Return an ETag and the last update time of a shows_page() query.
+
+  Computed by aggregating the page in the database, so the page itself
+  only has to be fetched when it is rendered.
+  """
+  page = page.subquery()
+  version = db.session.query(db.func.count(), db.func.sum(page.c.id),
+    db.func.max(page.c.updated_at), db.func.max(page.c.venue_updated_at),
+    db.func.max(page.c.artist_updated_at)).one()
+  return content_etag(list(version)), latest(*version[2:])
+
 @app.route('/shows')
 def shows():
-  shows = Show.query.order_by(Show.start_time.desc()).all()
-  data = []
-  for show in shows:
-    venue = Venue.query.filter_by(id=show.venue_id).first()
-    artist = Artist.query.filter_by(id=show.artist_id).first()
-    data.append({
-      "venue_id": venue.id,
-      "venue_name": venue.name,       
-      "artist_id": artist.id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": str(show.start_time),
-    })
-  return render_template('pages/shows.html', shows=data)
+  cursor = request.args.get('cursor')
+  limit = app.config['SHOWS_PER_PAGE']
+  page = shows_page(cursor, limit)
+  etag, last_modified = shows_page_version(page)
+  data = CappedRows(page.yield_per(500), limit,
+    lambda row: encode_show_cursor(row.start_time, row.id))
+  return conditional_response(content_etag([cursor, etag]), last_modified,
+    lambda: Response(stream_with_context(stream_template('pages/shows.html', shows=data))))
+
+@app.route('/shows/events')
+def show_event_stream():
+  """Stream created, updated and deleted upcoming shows as Server-Sent Events.
+
+  ``venue_id``, ``artist_id``, ``city`` and ``state`` narrow the stream.
+  """
+  filters = {'city': request.args.get('city'), 'state': request.args.get('state')}
+  for name in ('venue_id', 'artist_id'):
+    filters[name] = request.args.get(name, type=int)
+    if name in request.args and filters[name] is None:
+      abort(400)
+  subscription = show_events.subscribe(**filters)
+  response = Response(sse_stream(subscription, app.config['SHOW_EVENTS_HEARTBEAT_SECONDS'],
+    app.config['SHOW_EVENTS_RETRY_MS']), mimetype='text/event-stream')
+  response.headers['Cache-Control'] = 'no-cache'
+  # keep nginx from buffering the stream
+  response.headers['X-Accel-Buffering'] = 'no'
+  return response
 
 @app.route('/shows/create')
 def create_shows():
@@ -501,15 +1249,35 @@ def create_show_submission():
   artist_id =  request.form['artist_id']
   venue_id = request.form['venue_id']
   start_time = request.form['start_time']
-  show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
+  try:
+    show = Show(artist_id=int(artist_id), venue_id=int(venue_id), start_time=dateutil.parser.parse(start_time))
+  except (ValueError, OverflowError):
+    abort(400)
+  if cached_row(Venue, show.venue_id) is None or cached_row(Artist, show.artist_id) is None:
+    abort(400)
+  show.end_time = show.start_time + show_duration()
+  lock_bookings()
+  conflicts = booking_conflicts(show.venue_id, show.artist_id, show.start_time, show.end_time)
+  if conflicts:
+    db.session.rollback()
+    flash('Show at ' + start_time + ' could not be listed. The venue or artist is already booked at ' +
+      ', '.join(str(conflict.start_time) for conflict in conflicts) + '.')
+    return render_template('forms/new_show.html', form=ShowForm()), 409
   try:
     db.session.add(show)
     db.session.commit()
+    detail_cache.invalidate(('venue', show.venue_id), ('artist', show.artist_id))
+    publish_show_events('created', show_event_data(Show.id == show.id))
     flash('Show at ' + start_time + ' was successfully listed!')
+  except IntegrityError:
+    # a concurrent booking won the race past the check above
+    db.session.rollback()
+    flash('Show at ' + start_time + ' could not be listed. The venue or artist is already booked then.')
+    return render_template('forms/new_show.html', form=ShowForm()), 409
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('Could not list show at %s', start_time)
     flash('An error occurred. Show at ' + start_time + ' could not be listed.')
   finally:
     db.session.close()
@@ -518,6 +1286,396 @@ def create_show_submission():
   else:
     return render_template('pages/home.html')
 
+@app.route('/venues/<int:venue_id>/free-slots')
+def venue_free_slots(venue_id):
+  try:
+    start = dateutil.parser.parse(request.args['start'])
+    end = dateutil.parser.parse(request.args['end'])
+  except (KeyError, ValueError, OverflowError):
+    abort(400)
+  if not start < end <= start + timedelta(days=app.config['FREE_SLOTS_MAX_DAYS']):
+    abort(400)
+  min_length = timedelta(minutes=request.args.get('duration',
+    app.config['SHOW_DURATION_MINUTES'], type=int))
+  if db.session.query(Venue.id).filter(Venue.id == venue_id).scalar() is None:
+    abort(404)
+
+  busy = db.session.query(Show.start_time, Show.end_time).\
+    filter(overlapping_shows(Show.venue_id, venue_id, start, end)).\
+    order_by(Show.start_time)
+  return jsonify({
+    'success': True,
+    'venue_id': venue_id,
+    'slots': [{
+      'start': slot_start.isoformat(),
+      'end': slot_end.isoformat()
+    } for slot_start, slot_end in free_slots(busy, start, end, min_length)]
+  })
+
+#  Calendar
+#  ----------------------------------------------------------------
+
+def calendar_scope(venue_id=None, artist_id=None, city=None, state=None):
+  """Return ``(scope, key, name, condition)`` of a calendar; 404 if unknown.
+
+  ``condition(shows)`` filters the columns of a show_source() selectable.
+  """
+  if venue_id is not None:
+    name = db.session.query(Venue.name).filter(Venue.id == venue_id).scalar()
+    scope, condition = 'venue', lambda shows: shows.c.venue_id == venue_id
+  elif artist_id is not None:
+    name = db.session.query(Artist.name).filter(Artist.id == artist_id).scalar()
+    scope, condition = 'artist', lambda shows: shows.c.artist_id == artist_id
+  else:
+    name = '{}, {}'.format(city, state)
+    scope, condition = 'city', lambda shows: db.and_(Venue.city == city, Venue.state == state)
+  if name is None:
+    abort(404)
+  return scope, month_count_key(scope, venue_id or artist_id, city, state), name, condition
+
+def calendar_shows(condition, start, end=None):
+  """Query the shows matching ``condition`` that start in [start, end).
+
+  The archive is only read if the range starts before archive_horizon().
+  """
+  shows = show_source(datetime.combine(start, datetime.min.time()) < archive_horizon(),
+    lambda table: table.c.start_time >= start)
+  query = db.session.query(shows.c.id, shows.c.start_time, shows.c.end_time, shows.c.updated_at,
+      Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+      Venue.address, Venue.city, Venue.state,
+      Artist.id.label('artist_id'), Artist.name.label('artist_name')
+    ).join(Venue, shows.c.venue_id == Venue.id).\
+    join(Artist, shows.c.artist_id == Artist.id).\
+    filter(condition(shows), shows.c.start_time >= start)
+  if end is not None:
+    query = query.filter(shows.c.start_time < end)
+  return query.order_by(shows.c.start_time, shows.c.id)
+
+def calendar_date(name, default=None):
+  try:
+    return dateutil.parser.parse(request.args[name]).date()
+  except KeyError:
+    return default
+  except (ValueError, OverflowError):
+    abort(400)
+
+@app.route('/venues/<int:venue_id>/calendar')
+@app.route('/artists/<int:artist_id>/calendar')
+@app.route('/cities/<state>/<city>/calendar')
+def show_calendar(venue_id=None, artist_id=None, city=None, state=None):
+  view = request.args.get('view', 'month')
+  if view not in CALENDAR_VIEWS:
+    abort(400)
+  start, end, previous, next = calendar_range(view, calendar_date('date', date.today()))
+  scope, key, name, condition = calendar_scope(venue_id, artist_id, city, state)
+
+  limit = app.config['CALENDAR_MAX_SHOWS']
+  rows = calendar_shows(condition, start, end).limit(limit + 1).all()
+  months = db.session.query(ShowMonthCount.month, ShowMonthCount.count).\
+    filter(ShowMonthCount.scope == scope, ShowMonthCount.key == key,
+      ShowMonthCount.count > 0).\
+    order_by(ShowMonthCount.month)
+  return jsonify({
+    'success': True,
+    'name': name,
+    'view': view,
+    'start': start.isoformat(),
+    'end': end.isoformat(),
+    'previous': previous.isoformat(),
+    'next': next.isoformat(),
+    'truncated': len(rows) > limit,
+    'shows': [{
+      'id': row.id,
+      'start_time': row.start_time.isoformat(),
+      'end_time': row.end_time.isoformat(),
+      'venue_id': row.venue_id,
+      'venue_name': row.venue_name,
+      'artist_id': row.artist_id,
+      'artist_name': row.artist_name
+    } for row in rows[:limit]],
+    'months': dict((month, count) for month, count in months)
+  })
+
+@app.route('/venues/<int:venue_id>/calendar.ics')
+@app.route('/artists/<int:artist_id>/calendar.ics')
+@app.route('/cities/<state>/<city>/calendar.ics')
+def export_calendar(venue_id=None, artist_id=None, city=None, state=None):
+  """Stream the shows from ``start`` (default today) until ``end`` as iCalendar."""
+  scope, key, name, condition = calendar_scope(venue_id, artist_id, city, state)
+  rows = calendar_shows(condition, calendar_date('start', date.today()),
+    calendar_date('end')).yield_per(500)
+  events = ({
+    'uid': 'show-{}@fyyur'.format(row.id),
+    'stamp': row.updated_at,
+    'start': row.start_time,
+    'end': row.end_time,
+    'summary': '{} at {}'.format(row.artist_name, row.venue_name),
+    'location': ', '.join(part for part in (row.venue_name, row.address, row.city, row.state) if part)
+  } for row in rows)
+  return Response(stream_with_context(ical_calendar(name, events)),
+    mimetype='text/calendar',
+    headers={'Content-Disposition': 'attachment; filename="{}-{}.ics"'.format(scope, key.replace('|', '-'))})
+
+#  Browse
+#  ----------------------------------------------------------------
+
+BROWSE_MODELS = {
+  'venues': (Venue, Venue.seeking_talent),
+  'artists': (Artist, Artist.seeking_venue),
+}
+
+def facet_filters(model, seeking, genres, city, state, seeking_value):
+  """Return a facet name -> filter condition dict for the selected values."""
+  filters = {}
+  if genres:
+    table, column = GENRE_LINKS[model]
+    filters['genre'] = model.id.in_(db.select([column]).
+      select_from(table.join(Genre, Genre.id == table.c.genre_id)).
+      where(Genre.name.in_(genres)))
+  if city:
+    filters['city'] = model.city == city
+  if state:
+    filters['state'] = model.state == state
+  if seeking_value is not None:
+    filters['seeking'] = seeking == seeking_value
+  return filters
+
+def facet_counts(model, seeking, filters):
+  """Count matches per facet value with one UNION ALL of grouped selects.
+
+  Each facet is counted under the filters of all other facets, so the counts
+  tell how many results selecting another value of that facet would give.
+  """
+  def others(facet):
+    return [condition for name, condition in filters.items() if name != facet]
+
+  table, column = GENRE_LINKS[model]
+  branches = [
+    db.select([db.literal('total').label('facet'), db.literal('').label('value'),
+        db.func.count(model.id).label('count')]).
+      where(db.and_(db.true(), *filters.values())),
+    db.select([db.literal('genre'), Genre.name, db.func.count(model.id)]).
+      select_from(model.__table__.join(table, column == model.id).
+        join(Genre, Genre.id == table.c.genre_id)).
+      where(db.and_(db.true(), *others('genre'))).group_by(Genre.name),
+  ]
+  for facet, expression in (('city', model.city), ('state', model.state),
+      ('seeking', db.cast(db.func.coalesce(seeking, False), db.Integer))):
+    branches.append(
+      db.select([db.literal(facet), db.cast(expression, db.String), db.func.count(model.id)]).
+        where(db.and_(db.true(), *others(facet))).group_by(expression))
+
+  facets = {'genre': {}, 'city': {}, 'state': {}, 'seeking': {}}
+  total = 0
+  for facet, value, count in db.session.execute(db.union_all(*branches)):
+    if facet == 'total':
+      total = count
+    elif facet == 'seeking':
+      facets[facet]['true' if value == '1' else 'false'] = count
+    elif value is not None:
+      facets[facet][value] = count
+  return total, facets
+
+@app.route('/<any(venues, artists):kind>/browse')
+def browse(kind):
+  model, seeking = BROWSE_MODELS[kind]
+  seeking_value = request.args.get('seeking')
+  if seeking_value is not None:
+    seeking_value = seeking_value.lower() in ('1', 'true', 'y', 'yes')
+  filters = facet_filters(model, seeking, request.args.getlist('genre'),
+    request.args.get('city'), request.args.get('state'), seeking_value)
+  limit = min(request.args.get('limit', 20, type=int), 100)
+  offset = max(request.args.get('offset', 0, type=int), 0)
+
+  total, facets = facet_counts(model, seeking, filters)
+  rows = db.session.query(model.id, model.name, model.city, model.state, seeking).\
+    filter(*filters.values()).order_by(model.name, model.id).\
+    limit(limit).offset(offset)
+  return jsonify({
+    'success': True,
+    'count': total,
+    'data': [{
+      'id': row.id,
+      'name': row.name,
+      'city': row.city,
+      'state': row.state,
+      'seeking': bool(row[4])
+    } for row in rows],
+    'facets': facets
+  })
+
+#  Import
+#  ----------------------------------------------------------------
+
+def imported_batch(kind):
+  """Return the on_batch hook that refreshes state derived from ``kind`` rows.
+
+  Bulk inserts bypass the ORM, so the genre links are not created and the
+  mapper events maintaining the show and month counters do not fire for
+  them. The search indexes notice the new rows themselves.
+  """
+  def on_batch(rows):
+    if kind == 'venues':
+      link_genres(Venue, [row['name'] for row in rows])
+      db.session.commit()
+    elif kind == 'artists':
+      link_genres(Artist, [row['name'] for row in rows])
+      db.session.commit()
+    else:
+      venue_ids = set(row['venue_id'] for row in rows)
+      artist_ids = set(row['artist_id'] for row in rows)
+      refresh_show_counters(Venue, venue_ids)
+      refresh_show_counters(Artist, artist_ids)
+      rebuild_month_counts('venue', venue_ids)
+      rebuild_month_counts('artist', artist_ids)
+      rebuild_month_counts('city', set(month_count_key('city', city=city, state=state)
+        for city, state in db.session.query(Venue.city, Venue.state).filter(Venue.id.in_(venue_ids))))
+      db.session.commit()
+      detail_cache.invalidate(*[('venue', id) for id in venue_ids] +
+        [('artist', id) for id in artist_ids])
+  return on_batch
+
+@app.route('/import/<kind>', methods=['POST'])
+def import_upload(kind):
+  token = app.config['IMPORT_API_TOKEN']
+  supplied = request.headers.get('Authorization', '')
+  if not token or not hmac.compare_digest(supplied.encode(), ('Bearer ' + token).encode()):
+    abort(401)
+  upload = request.files.get('file')
+  if kind not in IMPORT_SPECS or upload is None:
+    abort(400)
+  fmt = request.args.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+  if fmt not in importer.FORMATS:
+    abort(400)
+
+  os.makedirs(app.config['IMPORT_REJECT_DIR'], exist_ok=True)
+  reject_path = os.path.join(app.config['IMPORT_REJECT_DIR'],
+    '{}-{}.jsonl'.format(kind, datetime.now().strftime('%Y%m%d%H%M%S%f')))
+  stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+  with open(reject_path, 'w') as reject_file:
+    report = importer.run_import(db.engine, IMPORT_SPECS[kind],
+      importer.read_records(stream, fmt), reject_file,
+      app.config['IMPORT_BATCH_SIZE'], imported_batch(kind))
+  result = report.as_dict()
+  result['success'] = True
+  result['rejects'] = reject_path if report.rejected else None
+  return jsonify(result)
+
+#  JSON API
+#  ----------------------------------------------------------------
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Fields the API returns for each kind of listing.
+API_FIELDS = {
+  'venues': (Venue, ['id', 'name', 'city', 'state', 'address', 'phone', 'genres',
+    'image_link', 'facebook_link', 'website_link', 'seeking_talent',
+    'seeking_description', 'upcoming_shows_count', 'past_shows_count']),
+  'artists': (Artist, ['id', 'name', 'city', 'state', 'phone', 'genres',
+    'image_link', 'facebook_link', 'website_link', 'seeking_venue',
+    'seeking_description', 'upcoming_shows_count', 'past_shows_count']),
+}
+SHOW_FIELDS = ['id', 'start_time', 'venue_id', 'venue_name', 'artist_id',
+  'artist_name', 'artist_image_link']
+
+def selected_fields(available):
+  """Return the fields named by ``?fields=a,b``, all of them by default."""
+  requested = request.args.get('fields')
+  if not requested:
+    return list(available)
+  fields = [field.strip() for field in requested.split(',') if field.strip()]
+  if not fields or set(fields) - set(available):
+    abort(400)
+  return fields
+
+def api_value(field, value):
+  if field == 'genres' and not isinstance(value, list):
+    return parse_genres(value)
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return value
+
+def stream_json(rows, fields):
+  """Stream ``{"success": true, "data": [...]}`` one row at a time."""
+  def generate():
+    yield '{"success": true, "data": ['
+    for i, row in enumerate(rows):
+      item = dict((field, api_value(field, getattr(row, field))) for field in fields)
+      yield (',' if i else '') + json.dumps(item)
+    yield ']}'
+  return Response(stream_with_context(generate()), mimetype='application/json')
+
+@api.route('/<any(venues, artists):kind>')
+def api_list(kind):
+  """Stream all venues or artists, optionally filtered by city and state."""
+  model, available = API_FIELDS[kind]
+  fields = selected_fields(available)
+  query = db.session.query(*[getattr(model, field) for field in fields])
+  for name in ('city', 'state'):
+    if name in request.args:
+      query = query.filter(getattr(model, name) == request.args[name])
+  return stream_json(query.order_by(model.id).yield_per(1000), fields)
+
+@api.route('/<any(venues, artists):kind>/<int:id>')
+def api_detail(kind, id):
+  data = cached_detail(kind[:-1], id, request.args.get('archived') == '1')
+  available = [key for key in data if key not in ('etag', 'last_modified')]
+  fields = selected_fields(available)
+  return conditional_response(content_etag([data['etag'], fields]), data['last_modified'],
+    lambda: jsonify({
+      'success': True,
+      'data': dict((field, api_value(field, data[field])) for field in fields)
+    }))
+
+@api.route('/<any(venues, artists):kind>/search')
+def api_search(kind):
+  model, available = API_FIELDS[kind]
+  fields = selected_fields(available)
+  page = max(request.args.get('page', 1, type=int), 1)
+  per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+  model_search = venue_search if kind == 'venues' else artist_search
+  total, rows = model_search.search(db.session, request.args.get('q', ''),
+    per_page, (page - 1) * per_page)
+  return jsonify({
+    'success': True,
+    'count': total,
+    'page': page,
+    'has_next': page * per_page < total,
+    'data': [dict((field, api_value(field, getattr(row, field))) for field in fields)
+      for row in rows]
+  })
+
+@api.route('/shows')
+def api_shows():
+  """Stream shows newest first, from an optional /shows cursor onwards."""
+  fields = selected_fields(SHOW_FIELDS)
+  query = shows_query()
+  for name, column in (('venue_id', Show.venue_id), ('artist_id', Show.artist_id)):
+    if name in request.args:
+      value = request.args.get(name, type=int)
+      if value is None:
+        abort(400)
+      query = query.filter(column == value)
+  if request.args.get('cursor'):
+    query = query.filter(db.tuple_(Show.start_time, Show.id) <
+      decode_show_cursor(request.args['cursor']))
+  return stream_json(query.order_by(Show.start_time.desc(), Show.id.desc()).yield_per(1000), fields)
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+  return jsonify({
+    'success': False,
+    'error': error.code,
+    'message': error.name.lower()
+  }), error.code
+
+app.register_blueprint(api)
+
+@app.route('/metrics')
+def metrics():
+  return jsonify({'routes': route_metrics.snapshot(), 'row_cache': row_cache.stats()})
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -528,14 +1686,175 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
+    start_queue_logging(app.logger, RotatingLogFileHandler(
+        app.config['LOG_FILE'], app.config['LOG_MAX_BYTES'],
+        app.config['LOG_BACKUP_COUNT'], app.config['LOG_ROTATE_SECONDS']))
     app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+
+#----------------------------------------------------------------------------#
+# Archive.
+#----------------------------------------------------------------------------#
+
+def ensure_archive_partitions(first, last):
+  """Create the yearly ShowArchive partitions covering [first, last] on PostgreSQL."""
+  for year in range(first.year, last.year + 1):
+    db.session.execute(db.text(
+      'CREATE TABLE IF NOT EXISTS "ShowArchive_{0}" PARTITION OF "ShowArchive" '
+      'FOR VALUES FROM (\'{0}-01-01\') TO (\'{1}-01-01\')'.format(year, year + 1)))
+
+def archive_shows(before, batch_size=5000):
+  """Move shows starting before ``before`` to ShowArchive, oldest first.
+
+  Each batch is copied and deleted with one INSERT ... SELECT and one
+  DELETE and committed on its own. Returns the number of shows moved.
+  """
+  table = Show.__table__
+  postgresql = db.session.connection().dialect.name == 'postgresql'
+  moved = 0
+  while True:
+    ids = [id for id, in db.session.execute(db.select([table.c.id]).
+      where(table.c.start_time < before).
+      order_by(table.c.start_time, table.c.id).limit(batch_size))]
+    if not ids:
+      return moved
+    batch = table.c.id.in_(ids)
+    if postgresql:
+      ensure_archive_partitions(*db.session.execute(db.select(
+        [db.func.min(table.c.start_time), db.func.max(table.c.start_time)]).where(batch)).first())
+    venue_ids = db.select([table.c.venue_id]).where(batch).distinct()
+    artist_ids = db.select([table.c.artist_id]).where(batch).distinct()
+    venue_ids, artist_ids = [[id for id, in db.session.execute(ids)]
+      for ids in (venue_ids, artist_ids)]
+    db.session.execute(ShowArchive.__table__.insert().from_select(SHOW_COLUMNS,
+      db.select([table.c[name] for name in SHOW_COLUMNS]).where(batch)))
+    db.session.execute(table.delete().where(batch))
+    refresh_show_counters(Venue, venue_ids)
+    refresh_show_counters(Artist, artist_ids)
+    db.session.commit()
+    moved += len(ids)
+
+#----------------------------------------------------------------------------#
+# Recommendations.
+#----------------------------------------------------------------------------#
+
+def build_recommendations(top_k, since=None, batch_size=5000):
+  """Store the ``top_k`` most similar venues of each venue and artists of each artist.
+
+  Similarities come from the venue x artist matrix of all shows, archived
+  ones included. With ``since`` only the venues and artists with shows
+  changed since then are recomputed. Each kind is replaced in one
+  transaction. Returns ``{kind: rows written}``.
+  """
+  shows = show_source(include_archive=True)
+  matrix, venue_ids, artist_ids = recommend.cooccurrence_matrix(db.session.execute(
+    db.select([shows.c.venue_id, shows.c.artist_id, db.func.count()]).
+    group_by(shows.c.venue_id, shows.c.artist_id)))
+  table = Recommendation.__table__
+  written = {}
+  for kind, ids, kind_matrix, foreign_key in (
+      ('venue', venue_ids, matrix, Show.venue_id),
+      ('artist', artist_ids, matrix.T.tocsr(), Show.artist_id)):
+    stale = table.c.kind == kind
+    positions = None
+    if since is not None:
+      changed = [id for id, in db.session.query(foreign_key).
+        filter(Show.updated_at >= since).distinct()]
+      position = dict((int(id), i) for i, id in enumerate(ids))
+      positions = [position[id] for id in changed if id in position]
+      stale = db.and_(stale, table.c.id.in_(changed))
+    db.session.execute(table.delete().where(stale))
+    rows = []
+    written[kind] = 0
+    for row, neighbours, scores in recommend.top_k_similar(kind_matrix, top_k, positions):
+      rows.extend({'kind': kind, 'id': int(ids[row]), 'rank': rank,
+          'other_id': int(ids[neighbour]), 'score': float(score)}
+        for rank, (neighbour, score) in enumerate(zip(neighbours, scores)))
+      if len(rows) >= batch_size:
+        db.session.execute(table.insert(), rows)
+        written[kind] += len(rows)
+        rows = []
+    if rows:
+      db.session.execute(table.insert(), rows)
+      written[kind] += len(rows)
+    db.session.commit()
+  return written
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('rollover-show-counters')
+@click.option('--since-hours', default=24, show_default=True,
+  help='Refresh entities with shows that started within this many hours.')
+@click.option('--all', 'refresh_all', is_flag=True,
+  help='Refresh every venue and artist, e.g. to backfill the counters.')
+def rollover_show_counters(since_hours, refresh_all):
+  """Move shows that have started from the upcoming to the past counters."""
+  now = datetime.now()
+  since = now - timedelta(hours=since_hours)
+  for model, foreign_key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    ids = None
+    if not refresh_all:
+      ids = db.select([foreign_key]).\
+        where(Show.start_time > since).where(Show.start_time <= now).distinct()
+    updated = refresh_show_counters(model, ids, now)
+    click.echo('{}: refreshed {} rows'.format(model.__tablename__, updated))
+  db.session.commit()
+
+@app.cli.command('build-recommendations')
+@click.option('--top-k', type=int, default=None,
+  help='Similar venues/artists stored per venue/artist. Defaults to RECOMMENDATIONS_TOP_K.')
+@click.option('--since-hours', type=float, default=None,
+  help='Only recompute venues and artists whose shows changed within this many hours.')
+def build_recommendations_command(top_k, since_hours):
+  """Recompute the similar venues and artists shown on detail pages."""
+  since = None if since_hours is None else datetime.utcnow() - timedelta(hours=since_hours)
+  try:
+    written = build_recommendations(top_k or app.config['RECOMMENDATIONS_TOP_K'], since)
+  except ImportError as e:
+    raise click.ClickException('build-recommendations needs numpy and scipy ({})'.format(e))
+  for kind, count in written.items():
+    click.echo('{}: {} recommendations'.format(kind, count))
+
+@app.cli.command('archive-shows')
+@click.option('--older-than-days', type=int, default=None,
+  help='Archive shows that started this many days ago. Defaults to SHOW_ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', default=5000, show_default=True)
+def archive_shows_command(older_than_days, batch_size):
+  """Move past shows from Show to ShowArchive."""
+  if older_than_days is None:
+    before = archive_horizon()
+  else:
+    before = datetime.now() - timedelta(days=older_than_days)
+  if before > datetime.now() - timedelta(minutes=app.config['SHOW_MAX_DURATION_MINUTES']):
+    raise click.BadParameter('shows that may still be running cannot be archived')
+  click.echo('Archived {} shows that started before {}'.format(
+    archive_shows(before, batch_size), before))
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_SPECS)))
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(importer.FORMATS),
+  help='Input format, guessed from the file extension by default.')
+@click.option('--rejects', type=click.File('w'), default=None,
+  help='Where rejected rows are written. Defaults to SOURCE.rejects.jsonl.')
+@click.option('--batch-size', type=int, default=None,
+  help='Rows per insert batch. Defaults to IMPORT_BATCH_SIZE.')
+def import_data(kind, source, fmt, rejects, batch_size):
+  """Bulk load venues, artists or shows from a CSV or JSONL file."""
+  fmt = fmt or source.name.rsplit('.', 1)[-1].lower()
+  if fmt not in importer.FORMATS:
+    raise click.BadParameter('cannot guess the format of {}'.format(source.name))
+  if rejects is None:
+    rejects = open('{}.rejects.jsonl'.format(source.name), 'w')
+  with rejects:
+    report = importer.run_import(db.engine, IMPORT_SPECS[kind],
+      importer.read_records(source, fmt), rejects,
+      batch_size or app.config['IMPORT_BATCH_SIZE'], imported_batch(kind))
+  click.echo('{accepted} rows imported, {rejected} rejected in {seconds}s '
+    '({rows_per_second} rows/s)'.format(**report.as_dict()))
+  if report.rejected:
+    click.echo('Rejected rows written to {}'.format(rejects.name))
 
 #----------------------------------------------------------------------------#
 # Launch.
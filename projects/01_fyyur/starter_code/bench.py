@@ -0,0 +1,336 @@
+"""Benchmark the Fyyur routes and report latency and SQL query counts.
+
+Usage: python bench.py [--requests 200] [--output bench.json] [--compare old.json]
+
+Every route below is requested --requests times (after --warmup requests)
+through the Flask test client, with ids drawn at random from the configured
+database, e.g. one filled by seed.py. With --url the requests go to a
+running server instead and query counts are not available. --concurrency
+sends requests from several threads at once.
+
+For each route the report holds the throughput, the p50/p95/p99/max latency
+in milliseconds and the mean and maximum number of SQL statements per
+request. It is printed as JSON, or written to --output, so the reports of
+two commits can be diffed; --compare prints the change against an older
+report. Write routes (--writes) create, edit and delete rows, so only use
+them on a throwaway database; delete_venue deletes the venues create_venue
+made before it.
+
+Two routes are left out: /shows/events streams until the client goes away,
+so it has no latency, and /import/<kind> needs the import token and an
+uploaded file; time it with `flask import-data` instead. Recommendations
+have no route of their own and are timed as part of the detail pages.
+"""
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, db, detail_cache, Venue, Artist, Show
+from forms import VenueForm
+
+# (name, method, url, form data); placeholders are filled per request.
+READ_ROUTES = [
+    ('index', 'GET', '/', None),
+    ('venues', 'GET', '/venues', None),
+    ('search_venues', 'POST', '/venues/search', {'search_term': '{word}'}),
+    ('search_venues_page', 'GET', '/venues/search?search_term={word}&page=2', None),
+    ('suggest_venues', 'GET', '/venues/search/suggest?q={word}', None),
+    ('show_venue', 'GET', '/venues/{venue_id}', None),
+    ('venue_calendar', 'GET', '/venues/{venue_id}/calendar', None),
+    ('venue_calendar_ics', 'GET', '/venues/{venue_id}/calendar.ics', None),
+    ('venue_free_slots', 'GET', '/venues/{venue_id}/free-slots?start={today}&end={next_week}', None),
+    ('browse_venues', 'GET', '/venues/browse?state={state}', None),
+    ('artists', 'GET', '/artists', None),
+    ('search_artists', 'POST', '/artists/search', {'search_term': '{word}'}),
+    ('search_artists_page', 'GET', '/artists/search?search_term={word}&page=2', None),
+    ('suggest_artists', 'GET', '/artists/search/suggest?q={word}', None),
+    ('show_artist', 'GET', '/artists/{artist_id}', None),
+    ('artist_calendar', 'GET', '/artists/{artist_id}/calendar', None),
+    ('artist_calendar_ics', 'GET', '/artists/{artist_id}/calendar.ics', None),
+    ('browse_artists', 'GET', '/artists/browse?genre={genre}', None),
+    ('shows', 'GET', '/shows', None),
+    ('city_calendar', 'GET', '/cities/{state}/{city}/calendar?view=week', None),
+    ('city_calendar_ics', 'GET', '/cities/{state}/{city}/calendar.ics?end={next_week}', None),
+    ('edit_venue_form', 'GET', '/venues/{venue_id}/edit', None),
+    ('edit_artist_form', 'GET', '/artists/{artist_id}/edit', None),
+    ('create_venue_form', 'GET', '/venues/create', None),
+    ('create_artist_form', 'GET', '/artists/create', None),
+    ('create_show_form', 'GET', '/shows/create', None),
+    ('api_venues', 'GET', '/api/v1/venues?fields=id,name,city,state', None),
+    ('api_artists', 'GET', '/api/v1/artists?fields=id,name,city,state', None),
+    ('api_venue', 'GET', '/api/v1/venues/{venue_id}', None),
+    ('api_artist', 'GET', '/api/v1/artists/{artist_id}', None),
+    ('api_search_venues', 'GET', '/api/v1/venues/search?q={word}', None),
+    ('api_search_artists', 'GET', '/api/v1/artists/search?q={word}', None),
+    ('api_shows', 'GET', '/api/v1/shows?venue_id={venue_id}', None),
+    ('metrics', 'GET', '/metrics', None),
+]
+WRITE_ROUTES = [
+    ('create_venue', 'POST', '/venues/create', {
+        'name': 'Bench Venue {unique}', 'city': '{city}', 'state': '{state}',
+        'address': '1 Bench St', 'phone': '555-555-5555', 'genres': '{genre}',
+        'website_link': '', 'facebook_link': '', 'image_link': '', 'seeking_description': ''}),
+    ('create_artist', 'POST', '/artists/create', {
+        'name': 'Bench Artist {unique}', 'city': '{city}', 'state': '{state}',
+        'phone': '555-555-5555', 'genres': '{genre}',
+        'website_link': '', 'facebook_link': '', 'image_link': '', 'seeking_description': ''}),
+    ('create_show', 'POST', '/shows/create', {
+        'venue_id': '{venue_id}', 'artist_id': '{artist_id}', 'start_time': '{future}'}),
+    ('edit_venue', 'POST', '/venues/{venue_id}/edit', {
+        'name': 'Edited Venue {unique}', 'city': '{city}', 'state': '{state}',
+        'address': '2 Bench St', 'phone': '555-555-5555', 'genres': '{genre}',
+        'website_link': '', 'facebook_link': '', 'image_link': '', 'seeking_description': ''}),
+    ('edit_artist', 'POST', '/artists/{artist_id}/edit', {
+        'name': 'Edited Artist {unique}', 'city': '{city}', 'state': '{state}',
+        'phone': '555-555-5555', 'genres': '{genre}',
+        'website_link': '', 'facebook_link': '', 'image_link': '', 'seeking_description': ''}),
+    ('delete_venue', 'DELETE', '/venues/{bench_venue_id}', None),
+]
+
+_local = threading.local()
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _local.statements = getattr(_local, 'statements', 0) + 1
+
+
+class Sample(object):
+    """Random ids and values the route placeholders are filled with."""
+
+    def __init__(self, rng, size=200):
+        self.rng = rng
+        self.venue_ids = [id for id, in db.session.query(Venue.id).limit(size * 10)]
+        self.artist_ids = [id for id, in db.session.query(Artist.id).limit(size * 10)]
+        self.cities = db.session.query(Venue.city, Venue.state).distinct().limit(size).all()
+        names = [name for name, in db.session.query(Venue.name).limit(size)]
+        self.words = sorted(set(word for name in names for word in name.split()
+                                if not word.isdigit())) or ['music']
+        self.genres = [value for value, label in VenueForm.genres.kwargs['choices']]
+        self.unique = 0
+        self.bench_venue_ids = None
+        self.lock = threading.Lock()
+        if not self.venue_ids or not self.artist_ids:
+            sys.exit('bench.py needs at least one venue and one artist, see seed.py')
+
+    def bench_venue_id(self):
+        """Pop the id of a venue made by create_venue; 0 (not found) once none are left."""
+        with self.lock:
+            if self.bench_venue_ids is None:
+                with app.app_context():
+                    self.bench_venue_ids = [id for id, in db.session.query(Venue.id).
+                                            filter(Venue.name.like('Bench Venue %'))]
+                    db.session.remove()
+            return self.bench_venue_ids.pop() if self.bench_venue_ids else 0
+
+    def values(self, url):
+        with self.lock:
+            self.unique += 1
+            unique = self.unique
+        city, state = self.rng.choice(self.cities)
+        today = datetime.now().date()
+        return {
+            'venue_id': self.rng.choice(self.venue_ids),
+            'artist_id': self.rng.choice(self.artist_ids),
+            'word': self.rng.choice(self.words),
+            'genre': self.rng.choice(self.genres),
+            'city': city,
+            'state': state,
+            'today': today.isoformat(),
+            'next_week': (today + timedelta(days=7)).isoformat(),
+            # far apart so created shows rarely collide with bookings
+            'future': (datetime(2100, 1, 1) + timedelta(hours=3 * unique + 10000 * self.rng.randrange(1000))).isoformat(),
+            'unique': '{}-{}'.format(int(time.time()), unique),
+            'bench_venue_id': self.bench_venue_id() if '{bench_venue_id}' in url else None,
+        }
+
+
+def fill(template, values):
+    if template is None:
+        return None
+    if isinstance(template, dict):
+        return dict((key, value.format(**values)) for key, value in template.items())
+    return template.format(**values)
+
+
+class ClientDriver(object):
+    """Send requests through the Flask test client, one client per thread."""
+
+    def __init__(self, cold):
+        self.cold = cold
+
+    def request(self, method, url, data):
+        client = getattr(_local, 'client', None)
+        if client is None:
+            client = _local.client = app.test_client()
+        if self.cold:
+            detail_cache.clear()
+        _local.statements = 0
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        return time.perf_counter() - started, response.status_code, _local.statements
+
+
+class HttpDriver(object):
+    """Send requests to a running server over HTTP."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, data):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(
+                    self.base_url + urllib.parse.quote(url, safe='/?&=:'),
+                    data=body, method=method)) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - started, status, None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, int(math.ceil(fraction * len(sorted_values))) - 1)]
+
+
+def bench_route(driver, sample, route, requests, warmup, concurrency):
+    name, method, url, data = route
+
+    def one(i):
+        values = sample.values(url)
+        return driver.request(method, fill(url, values), fill(data, values))
+
+    for i in range(warmup):
+        one(i)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, status, statements in results)
+    statements = [count for latency, status, count in results if count is not None]
+    statuses = {}
+    for latency, status, count in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'method': method,
+        'url': url,
+        'requests': requests,
+        'statuses': statuses,
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'queries_mean': round(sum(statements) / len(statements), 2) if statements else None,
+        'queries_max': max(statements) if statements else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Print the relative change of p50, p95 and queries per route to stderr."""
+    def change(new, old):
+        if new is None or old is None:
+            return '     -'
+        if not old:
+            return '{:+6.0f}'.format(new)
+        return '{:+5.0f}%'.format((new - old) * 100.0 / old)
+
+    print('{:<22} {:>10} {:>10} {:>10}'.format('route', 'p50', 'p95', 'queries'), file=sys.stderr)
+    for name, result in sorted(report['routes'].items()):
+        old = baseline['routes'].get(name)
+        if old is None:
+            print('{:<22} {:>10}'.format(name, 'new'), file=sys.stderr)
+            continue
+        print('{:<22} {:>10} {:>10} {:>10}'.format(name,
+              change(result['p50_ms'], old['p50_ms']),
+              change(result['p95_ms'], old['p95_ms']),
+              change(result['queries_mean'], old['queries_mean'])), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--routes', help='comma-separated route names to run')
+    parser.add_argument('--writes', action='store_true', help='also run the create routes')
+    parser.add_argument('--cold', action='store_true',
+                        help='clear the detail cache before every request')
+    parser.add_argument('--url', help='base URL of a running server to benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument('--compare', type=argparse.FileType('r'),
+                        help='earlier report to compare against')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    routes = READ_ROUTES + (WRITE_ROUTES if args.writes else [])
+    if args.routes:
+        names = args.routes.split(',')
+        routes = [route for route in routes if route[0] in names]
+
+    with app.app_context():
+        sample = Sample(random.Random(args.seed))
+        dialect = db.engine.dialect.name
+        rows = {
+            'venues': Venue.query.count(),
+            'artists': Artist.query.count(),
+            'shows': Show.query.count(),
+        }
+        db.session.remove()
+
+    driver = HttpDriver(args.url) if args.url else ClientDriver(args.cold)
+    event.listen(Engine, 'before_cursor_execute', _count_statement)
+    report = {
+        'commit': git_commit(),
+        'time': datetime.utcnow().isoformat() + 'Z',
+        'database': dialect,
+        'rows': rows,
+        'target': args.url or 'test-client',
+        'concurrency': args.concurrency,
+        'cold_cache': args.cold,
+        'routes': {},
+    }
+    try:
+        for route in routes:
+            report['routes'][route[0]] = bench_route(
+                driver, sample, route, args.requests, args.warmup, args.concurrency)
+            print('{:<22} p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms  {requests_per_second:>7} req/s'.format(
+                route[0], **report['routes'][route[0]]), file=sys.stderr)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count_statement)
+
+    json.dump(report, args.output, indent=2, sort_keys=True)
+    args.output.write('\n')
+    if args.compare:
+        compare(report, json.load(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class DetailCache(object):
+    """Thread-safe in-process cache for detail page data.
+
+    Each entry may carry an expiry time after which it is dropped on read,
+    e.g. the start time of the earliest cached upcoming show. Once
+    ``max_entries`` is reached the oldest entry is evicted.
+
+    For ``hold_seconds`` after a key is invalidated, values set for it are
+    not stored, since they may have been read from a lagging replica.
+    """
+
+    def __init__(self, max_entries=10000, hold_seconds=0):
+        self.max_entries = max_entries
+        self.hold_seconds = hold_seconds
+        self._entries = {}
+        self._held = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = now or datetime.now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            if self._held and self._held.get(key, 0) > time.monotonic():
+                return
+            self._entries.pop(key, None)
+            while self._entries and len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (value, expires_at)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            if self.hold_seconds:
+                now = time.monotonic()
+                self._held = dict((key, until) for key, until in self._held.items()
+                                  if until > now)
+                self._held.update((key, now + self.hold_seconds) for key in keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._held.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RowCache(object):
+    """Thread-safe LRU cache of row values with a time to live.
+
+    Holds at most ``max_entries`` values; the least recently read one is
+    evicted to make room. Values older than ``ttl_seconds`` are dropped on
+    read. Hits, misses, evictions and expirations are counted for stats().
+
+    A value is only stored if nothing was invalidated since the
+    ``generation`` at which it was read, so a row read before a concurrent
+    change commits is not cached. As in DetailCache, values set for a key
+    within ``hold_seconds`` of its invalidation are not stored either.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=300, hold_seconds=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hold_seconds = hold_seconds
+        self._entries = OrderedDict()
+        self._held = {}
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, generation=None):
+        """Store ``value``, read at ``generation`` (by default, now)."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self._held and self._held.get(key, 0) > time.monotonic():
+                return
+            self._entries.pop(key, None)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+            if self.hold_seconds:
+                now = time.monotonic()
+                self._held = dict((key, until) for key, until in self._held.items()
+                                  if until > now)
+                self._held.update((key, now + self.hold_seconds) for key in keys)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._held.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,118 @@
+import json
+import queue
+import threading
+
+# Sent to a subscriber whose queue overflowed, before its stream is closed.
+OVERFLOW_EVENT = 'reset'
+
+
+class Subscription(object):
+    """Events for one client, matching its filters, in a bounded queue.
+
+    If the client does not keep up and the queue fills, further events are
+    dropped and the subscription is marked overflowed; the client should
+    reload instead of showing an incomplete stream.
+    """
+
+    def __init__(self, bus, filters, max_queued):
+        self.bus = bus
+        self.filters = dict((name, value) for name, value in filters.items()
+                            if value is not None)
+        self.queue = queue.Queue(max_queued)
+        self.overflowed = False
+
+    def matches(self, data):
+        return all(data.get(name) == value for name, value in self.filters.items())
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Return the next ``(type, data)`` event, or None after ``timeout`` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus(object):
+    """In-process publish/subscribe of ``(type, data)`` events.
+
+    ``data`` is a dict; subscribers receive the events whose data has the
+    values of all their filters. Publishing never blocks, so a slow
+    subscriber cannot hold up the request that published. Only subscribers
+    of the same process are reached.
+    """
+
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, **filters):
+        subscription = Subscription(self, filters, self.max_queued)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, type, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.overflowed and subscription.matches(data):
+                subscription.offer((type, data))
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+def sse_message(type=None, data=None, id=None, retry=None):
+    """Format one Server-Sent Events message."""
+    lines = []
+    if id is not None:
+        lines.append('id: {}'.format(id))
+    if type is not None:
+        lines.append('event: {}'.format(type))
+    if retry is not None:
+        lines.append('retry: {}'.format(retry))
+    if data is not None:
+        lines.extend('data: ' + line for line in json.dumps(data, default=str).split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def sse_stream(subscription, heartbeat_seconds, retry_ms=None):
+    """Yield the SSE messages of ``subscription`` until it overflows.
+
+    A comment line is sent after ``heartbeat_seconds`` without events, so
+    proxies keep the connection open and closed clients are noticed. The
+    subscription is closed when the generator is.
+    """
+    try:
+        yield sse_message(retry=retry_ms) if retry_ms is not None else ': connected\n\n'
+        while True:
+            event = subscription.get(heartbeat_seconds)
+            if event is None:
+                if subscription.overflowed:
+                    yield sse_message(OVERFLOW_EVENT, {})
+                    return
+                yield ': heartbeat\n\n'
+                continue
+            type, data = event
+            yield sse_message(type, data)
+            if subscription.overflowed and subscription.queue.empty():
+                yield sse_message(OVERFLOW_EVENT, {})
+                return
+    finally:
+        subscription.close()
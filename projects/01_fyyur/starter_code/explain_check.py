@@ -0,0 +1,121 @@
+"""Check that the hot Fyyur routes read their tables through indexes.
+
+Every route below is requested through the Flask test client against the
+configured database. Each SELECT it runs is replayed with EXPLAIN and the
+plan is searched for full scans of the tables listed for that route.
+
+Usage: python explain_check.py
+
+The database should contain at least one venue and one artist. On
+PostgreSQL sequential scans are disabled for the replayed statements, so
+tiny development tables still report the index the planner would use on a
+large one. Exits with status 1 if any check fails.
+"""
+import json
+import sys
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app, db, detail_cache, Venue, Artist
+
+# (method, url, form data, tables that must not be scanned)
+ROUTES = [
+    ('GET', '/shows', None, ['Show', 'Venue', 'Artist']),
+    ('GET', '/artists', None, ['Artist']),
+    ('GET', '/venues/{venue_id}', None, ['Show', 'ShowArchive', 'Venue', 'Artist']),
+    ('GET', '/artists/{artist_id}', None, ['Show', 'ShowArchive', 'Venue', 'Artist']),
+    ('GET', '/venues/{venue_id}?archived=1', None, ['Show', 'ShowArchive', 'Venue', 'Artist']),
+    ('GET', '/artists/{artist_id}?archived=1', None, ['Show', 'ShowArchive', 'Venue', 'Artist']),
+]
+POSTGRES_ROUTES = [
+    ('POST', '/venues/search', {'search_term': 'music'}, ['Venue']),
+    ('POST', '/artists/search', {'search_term': 'music'}, ['Artist']),
+]
+
+
+def capture_statements(method, url, data):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    # listen on every engine, the route may read from a replica
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        detail_cache.clear()
+        response = app.test_client().open(url, method=method, data=data)
+        # streamed pages run their queries while the body is read
+        response.get_data()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+    return response.status_code, statements
+
+
+def sqlite_scans(cursor, statement, parameters, tables):
+    cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+    scans = []
+    for row in cursor.fetchall():
+        detail = row[-1]
+        for table in tables:
+            # "SCAN Show USING INDEX ..." walks an index, a bare "SCAN Show" does not
+            if detail.startswith('SCAN {}'.format(table)) and 'INDEX' not in detail:
+                scans.append(detail)
+    return scans
+
+
+def postgres_scans(cursor, statement, parameters, tables):
+    cursor.execute('SET enable_seqscan = off')
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in tables:
+            scans.append('Seq Scan on {}'.format(node['Relation Name']))
+        nodes.extend(node.get('Plans', []))
+    return scans
+
+
+def main():
+    with app.app_context():
+        engine = db.engine
+        dialect = engine.dialect.name
+        ids = {
+            'venue_id': db.session.query(db.func.min(Venue.id)).scalar(),
+            'artist_id': db.session.query(db.func.min(Artist.id)).scalar(),
+        }
+        db.session.remove()
+        if None in ids.values():
+            sys.exit('explain_check needs at least one venue and one artist')
+
+        routes = ROUTES + (POSTGRES_ROUTES if dialect == 'postgresql' else [])
+        explain = postgres_scans if dialect == 'postgresql' else sqlite_scans
+        failures = 0
+        for method, url, data, tables in routes:
+            url = url.format(**ids)
+            status, statements = capture_statements(method, url, data)
+            scans = []
+            connection = engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                for statement, parameters in statements:
+                    scans.extend(explain(cursor, statement, parameters, tables))
+                connection.rollback()
+            finally:
+                connection.close()
+            ok = status < 400 and not scans
+            failures += not ok
+            print('{} {} {} ({} statements, HTTP {})'.format(
+                'ok  ' if ok else 'FAIL', method, url, len(statements), status))
+            for scan in scans:
+                print('       ' + scan)
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,24 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local("python explain_check.py", capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def bench(output="bench.json", requests="200"):
+    local(
+        "python bench.py --requests {} --output {}".format(requests, output)
+    )
+
+
+def seed(venues="1000", artists="1000", shows="10000"):
+    local(
+        "python seed.py --venues {} --artists {} --shows {}".format(
+            venues, artists, shows)
+    )
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -39,9 +50,7 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run python explain_check.py")
 
 
 def deploy():
@@ -0,0 +1,324 @@
+import csv
+import io
+import json
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import func, select
+from werkzeug.datastructures import MultiDict
+
+FORMATS = ('csv', 'jsonl')
+
+
+class ImportSpec(object):
+    """How rows of one kind are validated and written.
+
+    ``form_class`` is the WTForms form whose validators a row has to pass.
+    ``columns`` are the table columns filled from the validated form data,
+    ``derived`` maps further columns to functions computing their value from
+    the validated ones and ``defaults`` are constant values for the remaining
+    columns. ``unique`` names a column whose value may not repeat (compared
+    case-insensitively), ``references`` maps integer columns to the tables
+    their ids must exist in and ``exclusion`` is an :class:`Exclusion` the
+    rows must keep.
+    """
+
+    def __init__(self, table, form_class, columns, derived=None, defaults=None,
+                 unique=None, references=None, exclusion=None):
+        self.table = table
+        self.form_class = form_class
+        self.columns = columns
+        self.derived = derived or {}
+        self.defaults = defaults or {}
+        self.unique = unique
+        self.references = references or {}
+        self.exclusion = exclusion
+
+    @property
+    def all_columns(self):
+        return list(self.columns) + list(self.derived) + list(self.defaults)
+
+
+class Exclusion(object):
+    """Rows sharing a value of one of ``columns`` may not overlap in time.
+
+    A row covers [``start``, ``end``). No stored row may cover more than
+    ``max_duration``, which bounds the rows a lookup has to read.
+    """
+
+    def __init__(self, columns, start, end, max_duration):
+        self.columns = columns
+        self.start = start
+        self.end = end
+        self.max_duration = max_duration
+
+
+class ImportReport(object):
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return (self.accepted + self.rejected) / max(self.elapsed, 1e-9)
+
+    def as_dict(self):
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def read_records(stream, fmt):
+    """Yield ``(line, record, error)`` for each row of a CSV or JSONL text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, line.rstrip('\n'), str(e)
+                continue
+            if isinstance(record, dict):
+                yield line_number, record, None
+            else:
+                yield line_number, record, 'expected a JSON object'
+    else:
+        raise ValueError('unknown format {!r}, expected one of {}'.format(fmt, FORMATS))
+
+
+def _formdata(record):
+    pairs = []
+    for key, value in record.items():
+        if isinstance(value, list):
+            pairs.extend((key, str(item)) for item in value)
+        elif isinstance(value, bool):
+            if value:
+                pairs.append((key, 'y'))
+        elif key == 'genres' and isinstance(value, str):
+            # CSV cells hold "Jazz,Rock" or the "{Jazz,Rock}" array literal
+            pairs.extend((key, genre.strip().strip('"'))
+                         for genre in value.strip('{}').split(',') if genre.strip())
+        elif value is not None:
+            pairs.append((key, str(value)))
+    return MultiDict(pairs)
+
+
+def validate(spec, record):
+    """Return ``(values, errors)`` for one record using the spec's form rules."""
+    form = spec.form_class(formdata=_formdata(record), meta={'csrf': False})
+    errors = {} if form.validate() else dict(form.errors)
+    for column in spec.columns:
+        # A required field left out of the record would validate with the
+        # form's default value, e.g. the time ShowForm was defined at.
+        field = getattr(form, column, None)
+        if field is not None and field.flags.required and not any(
+                str(raw).strip() for raw in field.raw_data or []):
+            errors.setdefault(column, ['This field is required.'])
+    if errors:
+        return None, errors
+    values = {}
+    for column in spec.columns:
+        value = form.data.get(column)
+        if isinstance(value, list):
+            value = ','.join(value)
+        elif value == '':
+            value = None
+        if column in spec.references:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                errors[column] = ['Not a valid id.']
+        values[column] = value
+    if errors:
+        return None, errors
+    if values.get('seeking_description') is not None and not (
+            values.get('seeking_talent') or values.get('seeking_venue')):
+        values['seeking_description'] = None
+    for column, derive in spec.derived.items():
+        values[column] = derive(values)
+    values.update(spec.defaults)
+    return values, None
+
+
+def _copy_batch(connection, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([r'\N' if row[column] is None else row[column]
+                         for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'.format(
+            table.name, ', '.join('"{}"'.format(column) for column in columns)),
+        buffer)
+
+
+def write_batch(connection, spec, rows):
+    """Insert rows with COPY on PostgreSQL and executemany elsewhere."""
+    if connection.dialect.name == 'postgresql':
+        _copy_batch(connection, spec.table, spec.all_columns, rows)
+    else:
+        connection.execute(spec.table.insert(), rows)
+
+
+def _overlaps(periods, start, end, max_duration):
+    index = bisect_left(periods, (start - max_duration,))
+    while index < len(periods) and periods[index][0] < end:
+        if periods[index][1] > start:
+            return True
+        index += 1
+    return False
+
+
+def exclusion_conflicts(connection, spec, rows):
+    """Return the columns of each of ``rows`` whose value is booked at an overlapping time.
+
+    Rows conflict with the stored rows and with the earlier ``rows`` that
+    did not conflict themselves, so the rows with an empty list can be
+    inserted together.
+    """
+    exclusion = spec.exclusion
+    if not rows:
+        return []
+    start, end = spec.table.c[exclusion.start], spec.table.c[exclusion.end]
+    earliest = min(row[exclusion.start] for row in rows) - exclusion.max_duration
+    latest = max(row[exclusion.end] for row in rows)
+    booked = {}
+    for name in exclusion.columns:
+        column = spec.table.c[name]
+        ids = set(row[name] for row in rows)
+        for id, period_start, period_end in connection.execute(
+                select([column, start, end]).where(column.in_(ids)).
+                where(start > earliest).where(start < latest)):
+            booked.setdefault((name, id), []).append((period_start, period_end))
+    for periods in booked.values():
+        periods.sort()
+
+    conflicts = []
+    for row in rows:
+        period = (row[exclusion.start], row[exclusion.end])
+        columns = [name for name in exclusion.columns if _overlaps(
+            booked.get((name, row[name]), []), period[0], period[1], exclusion.max_duration)]
+        if not columns:
+            for name in exclusion.columns:
+                insort(booked.setdefault((name, row[name]), []), period)
+        conflicts.append(columns)
+    return conflicts
+
+
+def _check_batch(connection, spec, batch, seen):
+    """Split ``(line, record, values)`` triples into accepted rows and rejects."""
+    missing = {}
+    for column, table in spec.references.items():
+        ids = set(values[column] for line, record, values in batch)
+        found = set(id for id, in connection.execute(
+            select([table.c.id]).where(table.c.id.in_(ids))))
+        missing[column] = ids - found
+
+    existing = set()
+    if spec.unique:
+        keys = set(values[spec.unique].lower() for line, record, values in batch)
+        column = func.lower(spec.table.c[spec.unique])
+        existing = set(key for key, in connection.execute(
+            select([column]).where(column.in_(keys))))
+
+    accepted = []
+    rejects = []
+    for line, record, values in batch:
+        errors = dict((column, ['Unknown id.']) for column in spec.references
+                      if values[column] in missing[column])
+        if spec.unique:
+            key = values[spec.unique].lower()
+            if key in existing or key in seen:
+                errors[spec.unique] = ['Already exists.']
+            else:
+                seen.add(key)
+        if errors:
+            rejects.append((line, record, errors))
+        else:
+            accepted.append((line, record, values))
+
+    if spec.exclusion:
+        conflicts = exclusion_conflicts(connection, spec, [values for line, record, values in accepted])
+        rejects.extend((line, record, dict((column, ['Already booked at an overlapping time.'])
+                                           for column in columns))
+                       for (line, record, values), columns in zip(accepted, conflicts) if columns)
+        accepted = [row for row, columns in zip(accepted, conflicts) if not columns]
+        rejects.sort(key=lambda reject: reject[0])
+    return accepted, rejects
+
+
+def run_import(engine, spec, records, reject_file, batch_size=5000, on_batch=None):
+    """Validate and insert ``records`` from :func:`read_records` in batches.
+
+    Invalid rows are written to ``reject_file`` as JSON lines holding the
+    source line number, the record and the errors. ``on_batch(rows)`` is
+    called with the inserted values after each committed batch. If a batch
+    fails as a whole its rows are retried one by one so that only the
+    offending rows are rejected.
+    """
+    report = ImportReport()
+    seen = set()
+
+    def reject(line, record, errors):
+        report.rejected += 1
+        reject_file.write(json.dumps(
+            {'line': line, 'record': record, 'errors': errors}, default=str) + '\n')
+
+    def flush(batch):
+        with engine.connect() as connection:
+            accepted, rejects = _check_batch(connection, spec, batch, seen)
+        for rejected in rejects:
+            reject(*rejected)
+        if not accepted:
+            return
+        try:
+            with engine.begin() as connection:
+                write_batch(connection, spec, [values for line, record, values in accepted])
+            inserted = accepted
+        except Exception:
+            inserted = []
+            for line, record, values in accepted:
+                try:
+                    with engine.begin() as connection:
+                        connection.execute(spec.table.insert(), [values])
+                    inserted.append((line, record, values))
+                except Exception as e:
+                    reject(line, record, {'database': [str(getattr(e, 'orig', e))]})
+        report.accepted += len(inserted)
+        if on_batch and inserted:
+            on_batch([values for line, record, values in inserted])
+
+    batch = []
+    for line, record, error in records:
+        if error:
+            reject(line, record, {'record': [error]})
+            continue
+        values, errors = validate(spec, record)
+        if errors:
+            reject(line, record, errors)
+            continue
+        batch.append((line, record, values))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    report.finished = time.time()
+    return report
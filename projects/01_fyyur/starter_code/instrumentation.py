@@ -0,0 +1,253 @@
+import atexit
+import json
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Attributes copied from log records into the JSON entry when present.
+REQUEST_FIELDS = ('request_id', 'method', 'route', 'path', 'status', 'db_ms', 'latency_ms')
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line.
+
+    Records logged while handling a request carry its id even if they were
+    not logged with one.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in REQUEST_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if 'request_id' not in entry:
+            timing = current_timing()
+            if timing is not None:
+                entry['request_id'] = timing.request_id
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RotatingLogFileHandler(RotatingFileHandler):
+    """Roll the log file over once it exceeds ``max_bytes`` or ``interval`` seconds."""
+
+    def __init__(self, filename, max_bytes, backup_count, interval):
+        RotatingFileHandler.__init__(self, filename, maxBytes=max_bytes,
+                                     backupCount=backup_count, delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return 1
+        return RotatingFileHandler.shouldRollover(self, record)
+
+    def doRollover(self):
+        RotatingFileHandler.doRollover(self)
+        self.rollover_at = time.time() + self.interval
+
+
+def start_queue_logging(logger, handler):
+    """Route ``logger`` through a queue drained by a background thread.
+
+    Records are formatted as JSON on the logging thread, which only enqueues
+    them; ``handler`` does the file I/O on the listener thread. Unless it was
+    stopped before, the listener is drained and stopped at exit.
+    """
+    records = queue.Queue(-1)
+    queue_handler = QueueHandler(records)
+    queue_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+
+    @atexit.register
+    def stop_listener():
+        if listener._thread is not None:
+            listener.stop()
+
+    logger.addHandler(queue_handler)
+    return listener
+
+
+def latency_bounds(smallest=0.0005, largest=120.0, factor=1.2):
+    """Geometric bucket bounds in seconds; percentiles are within ``factor``."""
+    count = int(math.ceil(math.log(largest / smallest, factor)))
+    return [smallest * factor ** i for i in range(count + 1)]
+
+
+class LatencyHistogram(object):
+    """Fixed-bucket latency histogram; not thread-safe on its own."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the given fraction."""
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(fraction * self.count)))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+
+class RouteMetrics(object):
+    """Thread-safe latency histograms keyed by route."""
+
+    def __init__(self, bounds=None):
+        self.bounds = bounds or latency_bounds()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, seconds):
+        with self._lock:
+            histogram = self._histograms.get(route)
+            if histogram is None:
+                histogram = self._histograms[route] = LatencyHistogram(self.bounds)
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Return ``{route: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}``."""
+        def ms(seconds):
+            return round(seconds * 1000, 2)
+
+        with self._lock:
+            return dict((route, {
+                'count': histogram.count,
+                'mean_ms': ms(histogram.total / histogram.count),
+                'p50_ms': ms(histogram.percentile(0.50)),
+                'p95_ms': ms(histogram.percentile(0.95)),
+                'p99_ms': ms(histogram.percentile(0.99)),
+                'max_ms': ms(histogram.max),
+            }) for route, histogram in self._histograms.items())
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+# WSGI environ key of the RequestTiming of a request. Unlike g, the environ
+# is the same while a streamed response is generated after the view returned.
+TIMING_KEY = 'fyyur.request_timing'
+
+
+class RequestTiming(object):
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+
+
+def current_timing():
+    return request.environ.get(TIMING_KEY) if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    timing = current_timing()
+    if timing is not None:
+        timing.db_time += time.perf_counter() - started
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get('query_started') \
+        if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _measured(iterable, finish):
+    """Yield from a response body, then call ``finish()``, also if the client left."""
+    try:
+        for chunk in iterable:
+            yield chunk
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+        finish()
+
+
+def instrument_requests(app, metrics, logger):
+    """Time every request of ``app`` and its database calls.
+
+    Each response gets an ``X-Request-ID`` header (taken from the request if
+    the client sent one), its latency is added to ``metrics`` under the
+    method and URL rule, and one INFO record with the request id, route,
+    status, database time and total latency is logged to ``logger``.
+    Streamed responses are measured until their last chunk was sent.
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_request_timer():
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        request.environ[TIMING_KEY] = RequestTiming(request_id)
+
+    @app.after_request
+    def record_request(response):
+        timing = current_timing()
+        if timing is None:
+            return response
+        rule = request.url_rule.rule if request.url_rule else None
+        route = '{} {}'.format(request.method, rule or '<unmatched>')
+        extra = {
+            'request_id': timing.request_id,
+            'method': request.method,
+            'route': rule,
+            'path': request.path,
+            'status': response.status_code,
+        }
+
+        def finish():
+            latency = time.perf_counter() - timing.started
+            metrics.observe(route, latency)
+            extra.update(db_ms=round(timing.db_time * 1000, 2),
+                         latency_ms=round(latency * 1000, 2))
+            logger.info('%s %s', route, extra['status'], extra=extra)
+
+        response.headers['X-Request-ID'] = timing.request_id
+        # Files passed through to the server (static files) are not wrapped,
+        # so the server can still send them with its file wrapper.
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = _measured(response.response, finish)
+        else:
+            finish()
+        return response
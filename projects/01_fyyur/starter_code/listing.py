@@ -0,0 +1,24 @@
+class CappedRows(object):
+    """At most ``limit`` rows of ``rows``, for a template rendered as a stream.
+
+    ``rows`` should produce one row more than ``limit`` if there are more,
+    e.g. a query with ``.limit(limit + 1)``; that row is only looked at, not
+    yielded. After iterating, ``next_token`` is ``token(row)`` of the last
+    yielded row if more rows followed, else None, so a template can link
+    to the continuation after its loop.
+    """
+
+    def __init__(self, rows, limit, token):
+        self.rows = rows
+        self.limit = limit
+        self.token = token
+        self.next_token = None
+
+    def __iter__(self):
+        last = None
+        for count, row in enumerate(self.rows):
+            if count == self.limit:
+                self.next_token = self.token(last)
+                return
+            last = row
+            yield row
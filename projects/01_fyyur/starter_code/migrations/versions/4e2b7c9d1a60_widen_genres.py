@@ -0,0 +1,29 @@
+"""widen genres
+
+Revision ID: 4e2b7c9d1a60
+Revises: 830dd91604b3
+Create Date: 2026-10-17 21:24:38.512907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e2b7c9d1a60'
+down_revision = '830dd91604b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # All genre choices joined by commas take 153 characters.
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('genres', existing_type=sa.String(length=120), type_=sa.Text())
+
+
+def downgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('genres', existing_type=sa.Text(), type_=sa.String(length=120))
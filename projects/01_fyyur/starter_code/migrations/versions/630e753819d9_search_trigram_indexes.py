@@ -0,0 +1,37 @@
+"""search trigram indexes
+
+Revision ID: 630e753819d9
+Revises: 76bbdefc5adc
+Create Date: 2026-10-17 20:42:07.905565
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '630e753819d9'
+down_revision = '76bbdefc5adc'
+branch_labels = None
+depends_on = None
+
+
+# Must match the document expression built by search.ModelSearch.
+SEARCH_COLUMNS = "coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || " \
+    "coalesce(state, '') || ' ' || coalesce(genres, '')"
+
+
+def upgrade():
+    # Other databases search through the in-process index instead.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('Venue', 'Artist'):
+        op.execute('CREATE INDEX IF NOT EXISTS "ix_{0}_search_trgm" ON "{0}" '
+                   'USING gin ((lower({1})) gin_trgm_ops)'.format(table, SEARCH_COLUMNS))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ('Venue', 'Artist'):
+        op.execute('DROP INDEX IF EXISTS "ix_{}_search_trgm"'.format(table))
@@ -0,0 +1,31 @@
+"""row update times
+
+Revision ID: cb9aa2d11e11
+Revises: f6c1b54a95cf
+Create Date: 2026-10-17 20:48:43.988119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cb9aa2d11e11'
+down_revision = 'f6c1b54a95cf'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE "{}" SET updated_at = CURRENT_TIMESTAMP'.format(table))
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,47 @@
+"""show end time and booking constraints
+
+Revision ID: f6c1b54a95cf
+Revises: 9c4352533008
+Create Date: 2026-10-17 20:46:23.594917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6c1b54a95cf'
+down_revision = '9c4352533008'
+branch_labels = None
+depends_on = None
+
+
+# SHOW_DURATION_MINUTES when end times were introduced.
+DURATION_MINUTES = 120
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if dialect == 'postgresql':
+        op.execute('UPDATE "Show" SET end_time = start_time + interval \'{} minutes\''.format(DURATION_MINUTES))
+    else:
+        op.execute('UPDATE "Show" SET end_time = datetime(start_time, \'+{} minutes\')'.format(DURATION_MINUTES))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    # Let PostgreSQL itself reject overlapping bookings of a venue or an artist.
+    # This fails if the existing shows already overlap.
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for column in ('venue_id', 'artist_id'):
+            op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_{0}_no_overlap" '
+                       'EXCLUDE USING gist ({0} WITH =, tsrange(start_time, end_time) WITH &&)'.format(column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for column in ('venue_id', 'artist_id'):
+            op.execute('ALTER TABLE "Show" DROP CONSTRAINT "Show_{}_no_overlap"'.format(column))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_column('end_time')
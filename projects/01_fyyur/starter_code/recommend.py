@@ -0,0 +1,68 @@
+"""Top-k venue and artist similarities from the venue x artist show matrix.
+
+Two venues are similar when the same artists played at both, two artists
+when they played at the same venues. Similarity is the cosine between rows
+(or columns) of the sparse co-occurrence matrix, with show counts damped
+by log1p so one artist's residency does not outweigh many one-off shows.
+
+NumPy and SciPy are only needed here and are imported when the functions
+run, so the web app does not load them.
+"""
+
+# Most entries of the dense similarity block computed at once; bounds the
+# memory of one batch to about 8 bytes times this.
+BLOCK_ENTRIES = 4 * 1024 * 1024
+
+
+def cooccurrence_matrix(pairs):
+    """Build the sparse venue x artist matrix from ``(venue_id, artist_id, shows)``.
+
+    Returns ``(matrix, venue_ids, artist_ids)``; row ``i`` of the matrix
+    belongs to ``venue_ids[i]`` and column ``j`` to ``artist_ids[j]``.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    pairs = np.asarray(list(pairs), dtype=np.int64).reshape(-1, 3)
+    venue_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    artist_ids, columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix((np.log1p(pairs[:, 2]), (rows, columns)),
+                               shape=(len(venue_ids), len(artist_ids)))
+    return matrix, venue_ids, artist_ids
+
+
+def top_k_similar(matrix, k, rows=None, block_entries=BLOCK_ENTRIES):
+    """Yield ``(row, neighbours, scores)`` of the ``k`` rows most similar to each row.
+
+    ``rows`` limits the rows whose neighbours are computed, e.g. those that
+    changed since the last run; all rows remain candidates. Similarities are
+    computed for as many rows at a time as fit in ``block_entries``, and
+    neighbours without anything in common are left out.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    count = matrix.shape[0]
+    if not count or k < 1:
+        return
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    normalized = sparse.diags(1.0 / np.where(norms > 0, norms, 1.0)) @ matrix
+    normalized = normalized.tocsr()
+    candidates = normalized.T.tocsc()
+    rows = np.arange(count) if rows is None else np.asarray(rows, dtype=np.int64)
+    k = min(k, count - 1)
+    if k < 1:
+        return
+    batch_size = max(1, block_entries // count)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        scores = (normalized[batch] @ candidates).toarray()
+        scores[np.arange(len(batch)), batch] = 0.0
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        for row, neighbours, row_scores in zip(batch, best, best_scores):
+            keep = row_scores > 0
+            yield row, neighbours[keep], row_scores[keep]
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+# Methods whose requests are served from a replica.
+READ_METHODS = ('GET', 'HEAD')
+# Cookie holding the time until which a client that wrote reads the primary.
+STICKY_COOKIE = 'fyyur_read_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of GET requests to a replica.
+
+    Everything else goes to the primary: flushes, UPDATE/DELETE statements,
+    work outside a request (CLI commands, imports) and requests from clients
+    that wrote recently, so they read their own writes. One replica is
+    picked at random per session.
+    """
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        self.db = db
+        self._replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        writing = self._flushing or isinstance(clause, UpdateBase)
+        if writing:
+            self.info['wrote'] = True
+        if writing or not self._reads_replica():
+            return SignallingSession.get_bind(self, mapper, clause)
+        if self._replica is None:
+            self._replica = random.choice(self.db.get_replica_engines(self.app))
+        return self._replica
+
+    def _reads_replica(self):
+        return bool(self.app.config['SQLALCHEMY_REPLICA_URIS']) and \
+            has_request_context() and request.method in READ_METHODS and \
+            not g.get('read_primary')
+
+
+def _after_commit(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        g.wrote_primary = True
+
+
+def _after_rollback(session):
+    session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with read replicas.
+
+    ``SQLALCHEMY_REPLICA_URIS`` lists the replicas; they get the same engine
+    options as the primary. After a request commits a write its client reads
+    from the primary for ``REPLICA_STICKY_SECONDS``, tracked in a cookie.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._replica_engines = {}
+        self._replica_lock = threading.Lock()
+        SQLAlchemy.__init__(self, *args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        SQLAlchemy.init_app(self, app)
+
+        @app.before_request
+        def read_own_writes():
+            try:
+                g.read_primary = float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+            except ValueError:
+                g.read_primary = False
+
+        @app.after_request
+        def stick_to_primary(response):
+            if g.get('wrote_primary') and app.config['SQLALCHEMY_REPLICA_URIS']:
+                seconds = app.config['REPLICA_STICKY_SECONDS']
+                response.set_cookie(STICKY_COOKIE, str(time.time() + seconds),
+                                    max_age=seconds, httponly=True, samesite='Lax')
+            return response
+
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, 'after_commit', _after_commit)
+        event.listen(factory, 'after_rollback', _after_rollback)
+        return factory
+
+    def get_replica_engines(self, app):
+        """Return the engines of the configured replicas, creating them once."""
+        uris = tuple(app.config['SQLALCHEMY_REPLICA_URIS'])
+        key = (id(app), uris)
+        with self._replica_lock:
+            engines = self._replica_engines.get(key)
+            if engines is None:
+                engines = self._replica_engines[key] = [
+                    self._create_replica_engine(app, uri) for uri in uris]
+            return engines
+
+    def _create_replica_engine(self, app, uri):
+        options = self.apply_pool_defaults(app, {})
+        result = self.apply_driver_hacks(app, make_url(uri), options)
+        # Flask-SQLAlchemy < 2.5 changes the options in place and returns None
+        url = result[0] if result else make_url(uri)
+        options.update(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        return create_engine(url, **options)
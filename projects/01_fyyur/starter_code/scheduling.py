@@ -0,0 +1,96 @@
+from datetime import date, datetime, timedelta
+
+# Views of the calendar endpoints.
+CALENDAR_VIEWS = ('month', 'week', 'day')
+
+
+def free_slots(busy, start, end, min_length=timedelta(0)):
+    """Return the gaps of at least ``min_length`` in [start, end) between busy intervals.
+
+    ``busy`` is an iterable of ``(start, end)`` pairs sorted by start time;
+    they may overlap each other and extend beyond the range.
+    """
+    slots = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start >= end:
+            break
+        if busy_start - cursor >= max(min_length, timedelta.resolution):
+            slots.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if end - cursor >= max(min_length, timedelta.resolution):
+        slots.append((cursor, end))
+    return slots
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def calendar_range(view, day):
+    """Return ``(start, end, previous, next)`` dates of the view containing ``day``.
+
+    Months start on the first, weeks on Monday. ``previous`` and ``next`` are
+    the starts of the neighbouring ranges.
+    """
+    if view == 'month':
+        start = day.replace(day=1)
+        return start, _add_months(start, 1), _add_months(start, -1), _add_months(start, 1)
+    if view == 'week':
+        start = day - timedelta(days=day.weekday())
+        step = timedelta(weeks=1)
+    elif view == 'day':
+        start = day
+        step = timedelta(days=1)
+    else:
+        raise ValueError('unknown view {!r}, expected one of {}'.format(view, CALENDAR_VIEWS))
+    return start, start + step, start - step, start + step
+
+
+def ical_escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').\
+        replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def ical_line(name, value):
+    """Return one content line folded at 75 octets, with its CRLF."""
+    line = '{}:{}'.format(name, value).encode('utf-8')
+    parts = []
+    while len(line) > 75:
+        cut = 75 if not parts else 74
+        # do not split a multi-byte character
+        while line[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def ical_time(value):
+    # floating local time, shows are stored in the venue's local time
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def ical_calendar(name, events):
+    """Yield the lines of an iCalendar document for ``events``.
+
+    ``events`` yields dicts with ``uid``, ``start``, ``end``, ``summary``,
+    ``location`` and ``stamp``; they are consumed lazily so the calendar can
+    be streamed.
+    """
+    yield ical_line('BEGIN', 'VCALENDAR')
+    yield ical_line('VERSION', '2.0')
+    yield ical_line('PRODID', '-//Fyyur//Calendar//EN')
+    yield ical_line('X-WR-CALNAME', ical_escape(name))
+    for event in events:
+        yield ical_line('BEGIN', 'VEVENT')
+        yield ical_line('UID', event['uid'])
+        yield ical_line('DTSTAMP', (event['stamp'] or datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ'))
+        yield ical_line('DTSTART', ical_time(event['start']))
+        yield ical_line('DTEND', ical_time(event['end']))
+        yield ical_line('SUMMARY', ical_escape(event['summary']))
+        yield ical_line('LOCATION', ical_escape(event['location']))
+        yield ical_line('END', 'VEVENT')
+    yield ical_line('END', 'VCALENDAR')
@@ -0,0 +1,252 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+from sqlalchemy import DDL, and_, case, event, func, literal_column
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Rows whose updated_at lies this long before the newest one already indexed
+# are read again on every refresh, so changes committed late, or stamped by
+# a worker whose clock is behind, are not missed.
+CHANGE_WINDOW = timedelta(minutes=1)
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+class InvertedIndex(object):
+    """In-process inverted index over weighted text fields.
+
+    Every token of every field is posted with the highest weight of the
+    fields it appears in. Query tokens are prefix-matched against the sorted
+    vocabulary, so partial words typed into the search box already match;
+    exact token matches score twice as much as prefix matches. A document
+    must match all query tokens. Documents can be replaced and removed one
+    at a time.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self._postings = {}
+        self._vocabulary = []
+        self._documents = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._documents
+
+    def __iter__(self):
+        return iter(self._documents)
+
+    def _tokens(self, fields):
+        tokens = {}
+        for field, text in fields.items():
+            weight = self.weights[field]
+            for token in tokenize(text):
+                if tokens.get(token, 0) < weight:
+                    tokens[token] = weight
+        return tokens
+
+    def build(self, documents):
+        """Index ``(doc_id, {field: text})`` pairs, replacing any old data."""
+        postings = {}
+        self._documents = {}
+        for doc_id, fields in documents:
+            tokens = self._tokens(fields)
+            self._documents[doc_id] = list(tokens)
+            for token, weight in tokens.items():
+                postings.setdefault(token, {})[doc_id] = weight
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+
+    def update(self, doc_id, fields):
+        """Index one document, replacing its old version."""
+        self.remove(doc_id)
+        tokens = self._tokens(fields)
+        self._documents[doc_id] = list(tokens)
+        for token, weight in tokens.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                insort(self._vocabulary, token)
+            posting[doc_id] = weight
+
+    def remove(self, doc_id):
+        for token in self._documents.pop(doc_id, ()):
+            posting = self._postings[token]
+            del posting[doc_id]
+            if not posting:
+                del self._postings[token]
+                del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _expand(self, prefix):
+        start = bisect_left(self._vocabulary, prefix)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def search(self, text):
+        """Return ``[(doc_id, score)]`` ordered by descending score."""
+        scores = None
+        for query_token in tokenize(text):
+            token_scores = {}
+            for token in self._expand(query_token):
+                factor = 2.0 if token == query_token else 1.0
+                for doc_id, weight in self._postings[token].items():
+                    score = weight * factor
+                    if token_scores.get(doc_id, 0) < score:
+                        token_scores[doc_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = dict((doc_id, score + token_scores[doc_id])
+                              for doc_id, score in scores.items()
+                              if doc_id in token_scores)
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class ModelSearch(object):
+    """Ranked, paginated text search over a few columns of one model.
+
+    On PostgreSQL the columns are concatenated into a lower-cased document
+    expression backed by a pg_trgm GIN index, so ``LIKE '%token%'`` filters
+    use the index and ``similarity()`` ranks the matches. Other databases
+    fall back to an :class:`InvertedIndex` in each process.
+
+    Before the index is searched, the ``updated_at`` of the rows changed
+    within CHANGE_WINDOW of the newest change already indexed, and the row
+    count, are read. Only the rows whose ``updated_at`` differs from the
+    last refresh are indexed again, and all ids are read only if the count
+    shows deleted or unseen rows. So changes made by other processes or by
+    bulk statements are seen as well, without rebuilding the index.
+    """
+
+    def __init__(self, model, weights):
+        self.model = model
+        self.weights = weights
+        self.index = InvertedIndex(weights)
+        self._recent = {}
+        self._indexed_until = None
+        self._lock = threading.Lock()
+
+        columns = [getattr(model, field) for field in weights]
+        document = func.coalesce(columns[0], literal_column("''"))
+        for column in columns[1:]:
+            document = document.op('||')(literal_column("' '")).\
+                op('||')(func.coalesce(column, literal_column("''")))
+        self.document = func.lower(document)
+
+        table = model.__table__
+        index_ddl = "CREATE INDEX IF NOT EXISTS \"ix_{0}_search_trgm\" ON \"{0}\" " \
+            "USING gin ((lower({1})) gin_trgm_ops)".format(
+                table.name,
+                " || ' ' || ".join("coalesce(\"{}\", '')".format(field) for field in weights))
+        event.listen(table, 'before_create', DDL(
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+        event.listen(table, 'after_create', DDL(index_ddl).execute_if(dialect='postgresql'))
+
+    def search(self, session, text, limit, offset=0):
+        """Return ``(total, rows)`` for one page of results, best match first."""
+        if not tokenize(text):
+            return 0, []
+        if session.connection().dialect.name == 'postgresql':
+            return self._search_sql(session, text, limit, offset)
+        return self._search_index(session, text, limit, offset)
+
+    def suggest(self, session, prefix, limit):
+        """Return up to ``limit`` ``(id, name)`` pairs for autocompletion."""
+        total, rows = self.search(session, prefix, limit)
+        return [(row.id, row.name) for row in rows]
+
+    def _search_sql(self, session, text, limit, offset):
+        model = self.model
+        tokens = tokenize(text)
+        term = ' '.join(tokens)
+        name = func.lower(model.name)
+        rank = func.similarity(self.document, term) + \
+            2 * func.similarity(name, term) + \
+            case([(name.like(term.replace('_', '\\_') + '%', escape='\\'), 1)], else_=0)
+        rows = session.query(model, func.count().over().label('total')).\
+            filter(and_(*[self.document.like('%' + token.replace('_', '\\_') + '%', escape='\\')
+                         for token in tokens])).\
+            order_by(rank.desc(), model.id).\
+            limit(limit).offset(offset).all()
+        total = rows[0].total if rows else 0
+        return total, [row[0] for row in rows]
+
+    def _documents(self, query):
+        columns = [getattr(self.model, field) for field in self.weights]
+        return ((row[0], dict(zip(self.weights, row[1:])))
+                for row in query.with_entities(self.model.id, *columns).yield_per(1000))
+
+    def _refresh(self, session):
+        """Bring the index up to date with the table.
+
+        The queries run without the lock, which is only held while the index
+        is compared with their results and changed. Threads refreshing at
+        once may apply a change twice, or an older version of a row after a
+        newer one; its recorded ``updated_at`` then differs from the table,
+        so the next refresh indexes the row again.
+        """
+        model = self.model
+        indexed_until = self._indexed_until
+        since = (indexed_until or datetime.min + CHANGE_WINDOW) - CHANGE_WINDOW
+        recent = dict(session.query(model.id, model.updated_at).filter(model.updated_at >= since))
+        if indexed_until is None:
+            documents = list(self._documents(session.query(model)))
+            with self._lock:
+                if self._indexed_until is None:
+                    self.index.build(documents)
+                    self._record(recent)
+            return
+        count = session.query(func.count(model.id)).scalar()
+        with self._lock:
+            changed = [id for id, updated_at in recent.items() if self._recent.get(id) != updated_at]
+            stale = len(self.index) + sum(1 for id in changed if id not in self.index) != count
+        removed = []
+        if stale:
+            ids = set(id for id, in session.query(model.id))
+            with self._lock:
+                removed = [doc_id for doc_id in self.index if doc_id not in ids]
+                changed.extend(id for id in ids if id not in self.index and id not in recent)
+        documents = []
+        for start in range(0, len(changed), 500):
+            documents.extend(self._documents(
+                session.query(model).filter(model.id.in_(changed[start:start + 500]))))
+        with self._lock:
+            for doc_id in removed:
+                self.index.remove(doc_id)
+            for doc_id, fields in documents:
+                self.index.update(doc_id, fields)
+            self._record(recent)
+
+    def _record(self, recent):
+        """Remember the ``updated_at`` read by a refresh; call with the lock held."""
+        latest = max(recent.values()) if recent else None
+        if latest is not None and (self._indexed_until is None or latest > self._indexed_until):
+            self._indexed_until = latest
+        elif self._indexed_until is None:
+            self._indexed_until = datetime.min + CHANGE_WINDOW
+        self._recent = recent
+
+    def _search_index(self, session, text, limit, offset):
+        model = self.model
+        self._refresh(session)
+        with self._lock:
+            matches = self.index.search(text)
+        ids = [doc_id for doc_id, score in matches[offset:offset + limit]]
+        if not ids:
+            return len(matches), []
+        by_id = dict((row.id, row) for row in
+                     session.query(model).filter(model.id.in_(ids)))
+        return len(matches), [by_id[doc_id] for doc_id in ids if doc_id in by_id]
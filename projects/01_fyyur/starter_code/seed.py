@@ -0,0 +1,217 @@
+"""Fill an empty Fyyur database with synthetic venues, artists and shows.
+
+Usage: python seed.py [--venues 100000] [--artists 50000] [--shows 1000000]
+
+Rows are written into the configured database (FYYUR_DATABASE_URI) in
+batches, with COPY on PostgreSQL. Popularity is skewed: cities, venues and
+artists are drawn from Zipf distributions, so a few venues are booked out
+while most host a handful of shows, as in real listings. Shows start at one
+of SLOTS_PER_DAY times on days spread around today and never overlap another
+booking of their venue or artist; shows that would overlap anyway, because
+SHOW_DURATION_MINUTES is longer than the slots are apart, are left out. The
+same --seed gives the same data.
+
+Afterwards the genre links, show counters and month counts are rebuilt.
+Run the migrations first, or pass --create to create the tables directly.
+"""
+import argparse
+import random
+import sys
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from app import (app, db, importer, link_genres, rebuild_month_counts,
+                 refresh_show_counters, IMPORT_SPECS, Venue, Artist, Show)
+from forms import VenueForm
+
+# Show start hours; three hours apart, so longer than a show.
+SLOT_HOURS = (12, 15, 18, 21)
+SLOTS_PER_DAY = len(SLOT_HOURS)
+# How often a taken slot is redrawn before another venue/artist is drawn.
+SLOT_RETRIES = 5
+
+CITIES = [
+    ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Houston', 'TX'),
+    ('Phoenix', 'AZ'), ('Philadelphia', 'PA'), ('San Antonio', 'TX'), ('San Diego', 'CA'),
+    ('Dallas', 'TX'), ('San Jose', 'CA'), ('Austin', 'TX'), ('Jacksonville', 'FL'),
+    ('San Francisco', 'CA'), ('Columbus', 'OH'), ('Seattle', 'WA'), ('Denver', 'CO'),
+    ('Nashville', 'TN'), ('Boston', 'MA'), ('Portland', 'OR'), ('Las Vegas', 'NV'),
+    ('Detroit', 'MI'), ('Memphis', 'TN'), ('Atlanta', 'GA'), ('Miami', 'FL'),
+    ('New Orleans', 'LA'), ('Minneapolis', 'MN'), ('Kansas City', 'MO'), ('Portland', 'ME'),
+]
+GENRES = [value for value, label in VenueForm.genres.kwargs['choices']]
+VENUE_WORDS = ['Hall', 'Club', 'Lounge', 'Room', 'Theatre', 'Bar', 'Garage', 'Cellar', 'Dome']
+ARTIST_WORDS = ['Band', 'Trio', 'Quartet', 'Collective', 'Orchestra', 'Project', 'Ensemble']
+ADJECTIVES = ['Blue', 'Golden', 'Velvet', 'Electric', 'Silent', 'Crimson', 'Lucky',
+              'Wild', 'Neon', 'Midnight', 'Rusty', 'Hollow', 'Bright', 'Broken']
+
+
+class ZipfSampler(object):
+    """Draw items with probability proportional to 1 / rank ** skew.
+
+    Ranks are assigned to the items in random order, so popularity does not
+    follow insertion order.
+    """
+
+    def __init__(self, rng, items, skew):
+        self.rng = rng
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cumulative = list(accumulate(1.0 / rank ** skew
+                                          for rank in range(1, len(self.items) + 1)))
+
+    def draw(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[min(bisect_left(self.cumulative, point), len(self.items) - 1)]
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write(kind, rows, batch_size, on_batch=None):
+    """Insert ``rows`` in batches, leaving out those breaking the spec's exclusion."""
+    spec = IMPORT_SPECS[kind]
+    count = 0
+    skipped = 0
+    for batch in batches(rows, batch_size):
+        with db.engine.begin() as connection:
+            if spec.exclusion:
+                conflicts = importer.exclusion_conflicts(connection, spec, batch)
+                skipped += sum(1 for columns in conflicts if columns)
+                batch = [row for row, columns in zip(batch, conflicts) if not columns]
+            if batch:
+                importer.write_batch(connection, spec, batch)
+        if on_batch and batch:
+            on_batch(batch)
+        count += len(batch)
+        print('{}: {} rows'.format(kind, count), end='\r', file=sys.stderr)
+    print(file=sys.stderr)
+    if skipped:
+        print('{}: skipped {} overlapping rows'.format(kind, skipped), file=sys.stderr)
+
+
+def entity_rows(rng, kind, count, cities, now):
+    words = VENUE_WORDS if kind == 'venues' else ARTIST_WORDS
+    for i in range(count):
+        city, state = cities.draw()
+        seeking = rng.random() < 0.2
+        row = {
+            'name': '{} {} {}'.format(rng.choice(ADJECTIVES), rng.choice(words), i + 1),
+            'city': city,
+            'state': state,
+            'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999),
+                                                   rng.randint(100, 999), rng.randint(0, 9999)),
+            'genres': ','.join(rng.sample(GENRES, rng.randint(1, 3))),
+            'image_link': None,
+            'facebook_link': None,
+            'website_link': None,
+            'seeking_description': 'Looking for new acts.' if seeking else None,
+            'updated_at': now,
+            'upcoming_shows_count': 0,
+            'past_shows_count': 0,
+        }
+        if kind == 'venues':
+            row['address'] = '{} {} St'.format(rng.randint(1, 9999), rng.choice(ADJECTIVES))
+            row['seeking_talent'] = seeking
+        else:
+            row['seeking_venue'] = seeking
+        yield row
+
+
+def show_rows(rng, count, venues, artists, days, now):
+    """Yield non-overlapping shows; stop early if the slots run out."""
+    first_day = datetime(now.year, now.month, now.day) - timedelta(days=days // 2)
+    slots = days * SLOTS_PER_DAY
+    venue_slots = set()
+    artist_slots = set()
+    misses = 0
+    produced = 0
+    while produced < count:
+        venue_id = venues.draw()
+        artist_id = artists.draw()
+        for attempt in range(SLOT_RETRIES):
+            slot = rng.randrange(slots)
+            if (venue_id, slot) not in venue_slots and (artist_id, slot) not in artist_slots:
+                break
+        else:
+            misses += 1
+            if misses > count:
+                print('stopping after {} shows, no free slots left'.format(produced),
+                      file=sys.stderr)
+                return
+            continue
+        venue_slots.add((venue_id, slot))
+        artist_slots.add((artist_id, slot))
+        start_time = first_day + timedelta(days=slot // SLOTS_PER_DAY,
+                                           hours=SLOT_HOURS[slot % SLOTS_PER_DAY])
+        produced += 1
+        yield {
+            'venue_id': venue_id,
+            'artist_id': artist_id,
+            'start_time': start_time,
+            'end_time': start_time + timedelta(minutes=app.config['SHOW_DURATION_MINUTES']),
+            'updated_at': now,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=730,
+                        help='days the shows are spread over, half of them in the past')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Zipf exponent of city, venue and artist popularity')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--create', action='store_true',
+                        help='create missing tables instead of relying on migrations')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    batch_size = args.batch_size or app.config['IMPORT_BATCH_SIZE']
+    with app.app_context():
+        if args.create:
+            db.create_all()
+        if db.session.query(Venue.id).first() or db.session.query(Artist.id).first():
+            sys.exit('seed.py expects empty Venue and Artist tables')
+
+        def linked(model):
+            def on_batch(rows):
+                link_genres(model, [row['name'] for row in rows])
+                db.session.commit()
+            return on_batch
+
+        cities = ZipfSampler(rng, CITIES, args.skew)
+        write('venues', entity_rows(rng, 'venues', args.venues, cities, now),
+              batch_size, linked(Venue))
+        write('artists', entity_rows(rng, 'artists', args.artists, cities, now),
+              batch_size, linked(Artist))
+
+        venues = ZipfSampler(rng, [id for id, in db.session.query(Venue.id)], args.skew)
+        artists = ZipfSampler(rng, [id for id, in db.session.query(Artist.id)], args.skew)
+        write('shows', show_rows(rng, args.shows, venues, artists, args.days, now), batch_size)
+
+        print('refreshing counters', file=sys.stderr)
+        refresh_show_counters(Venue)
+        refresh_show_counters(Artist)
+        for scope in ('venue', 'artist', 'city'):
+            rebuild_month_counts(scope)
+        db.session.commit()
+        print('{} venues, {} artists, {} shows'.format(
+            Venue.query.count(), Artist.query.count(), Show.query.count()))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,3 +2,25 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Elements with data-show-events="<events url>" are revealed when a show
+// they list is created, changed or removed, inviting a reload.
+document.addEventListener('DOMContentLoaded', function () {
+  var notices = document.querySelectorAll('[data-show-events]');
+  if (!window.EventSource) {
+    return;
+  }
+  Array.prototype.forEach.call(notices, function (notice) {
+    var source = new EventSource(notice.getAttribute('data-show-events'));
+    var reveal = function () {
+      notice.style.display = '';
+    };
+    ['created', 'updated', 'deleted'].forEach(function (type) {
+      source.addEventListener(type, reveal);
+    });
+    source.addEventListener('reset', function () {
+      reveal();
+      source.close();
+    });
+  });
+});
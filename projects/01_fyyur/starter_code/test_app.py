@@ -0,0 +1,215 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+# config reads the databases from the environment when app is imported; the
+# tests never touch a configured database. GET requests read the replica.
+DATA_DIR = tempfile.mkdtemp()
+os.environ['FYYUR_DATABASE_URI'] = 'sqlite:///' + os.path.join(DATA_DIR, 'primary.db')
+os.environ['FYYUR_REPLICA_URIS'] = 'sqlite:///' + os.path.join(DATA_DIR, 'replica.db')
+
+import app as fyyur
+import importer
+from app import Artist, Show, Venue, db
+from routing import STICKY_COOKIE
+
+
+class FyyurTestCase(unittest.TestCase):
+    """Base class creating empty tables with one venue and one artist."""
+
+    def setUp(self):
+        # outside of a request everything goes to the primary
+        self.context = fyyur.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+        fyyur.detail_cache.clear()
+        fyyur.row_cache.clear()
+        self.venue = Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                           address='1015 Folsom Street', phone='123-123-1234', genres='Jazz')
+        self.artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                             phone='326-123-5000', genres='Rock n Roll')
+        db.session.add_all([self.venue, self.artist])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+
+class ImportTestCase(FyyurTestCase):
+
+    def import_shows(self, records):
+        rejects = io.StringIO()
+        report = importer.run_import(db.engine, fyyur.IMPORT_SPECS['shows'],
+                                     ((line, record, None) for line, record in enumerate(records, 2)),
+                                     rejects)
+        return report, [json.loads(line) for line in rejects.getvalue().splitlines()]
+
+    def test_show_without_start_time_is_rejected(self):
+        start_time = datetime(2035, 5, 21, 21, 30)
+        report, rejects = self.import_shows([
+            {'venue_id': self.venue.id, 'artist_id': self.artist.id},
+            {'venue_id': self.venue.id, 'artist_id': self.artist.id, 'start_time': ''},
+            {'venue_id': self.venue.id, 'artist_id': self.artist.id,
+             'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')},
+        ])
+
+        self.assertEqual((report.accepted, report.rejected), (1, 2))
+        self.assertEqual([reject['line'] for reject in rejects], [2, 3])
+        for reject in rejects:
+            self.assertIn('start_time', reject['errors'])
+        self.assertEqual([show.start_time for show in Show.query], [start_time])
+
+    def test_overlapping_shows_are_rejected(self):
+        other_venue = Venue(name='Park Square Live Music & Coffee', city='San Francisco', state='CA',
+                            address='34 Whiskey Moore Ave', phone='415-000-1234', genres='Jazz')
+        db.session.add(other_venue)
+        db.session.add(Show(venue_id=self.venue.id, artist_id=self.artist.id,
+                            start_time=datetime(2035, 5, 21, 20), end_time=datetime(2035, 5, 21, 22)))
+        db.session.commit()
+        other_artist = Artist(name='Matt Quevedo', city='New York', state='NY',
+                              phone='300-400-5000', genres='Jazz')
+        db.session.add(other_artist)
+        db.session.commit()
+
+        report, rejects = self.import_shows([
+            # the venue is booked by the stored show
+            {'venue_id': self.venue.id, 'artist_id': other_artist.id, 'start_time': '2035-05-21 21:00:00'},
+            {'venue_id': other_venue.id, 'artist_id': other_artist.id, 'start_time': '2035-05-22 20:00:00'},
+            # the artist is booked by the row before
+            {'venue_id': self.venue.id, 'artist_id': other_artist.id, 'start_time': '2035-05-22 21:00:00'},
+            {'venue_id': self.venue.id, 'artist_id': other_artist.id, 'start_time': '2035-05-22 22:00:00'},
+        ])
+
+        self.assertEqual((report.accepted, report.rejected), (2, 2))
+        self.assertEqual([(reject['line'], list(reject['errors'])) for reject in rejects],
+                         [(2, ['venue_id']), (4, ['artist_id'])])
+        self.assertEqual(Show.query.count(), 3)
+
+
+class ShowCounterTestCase(FyyurTestCase):
+
+    def counters(self):
+        # the session does not expire objects on commit
+        return [db.session.query(model.upcoming_shows_count, model.past_shows_count).
+                filter(model.id == id).one() for model, id in ((Venue, self.venue.id),
+                                                               (Artist, self.artist.id))]
+
+    def test_deleting_show_that_started_since_it_was_counted(self):
+        show = Show(venue_id=self.venue.id, artist_id=self.artist.id,
+                    start_time=datetime.now() + timedelta(hours=1))
+        db.session.add(show)
+        db.session.commit()
+        self.assertEqual(self.counters(), [(1, 0), (1, 0)])
+
+        # the show starts, but the counters are not rolled over yet
+        db.session.execute(Show.__table__.update().values(start_time=datetime.now() - timedelta(hours=1)))
+        db.session.commit()
+        db.session.expunge_all()
+        db.session.delete(Show.query.get(show.id))
+        db.session.commit()
+
+        self.assertEqual(self.counters(), [(0, 0), (0, 0)])
+
+
+class BookingTestCase(FyyurTestCase):
+
+    def book(self, start_time):
+        return fyyur.app.test_client().post('/shows/create', data={
+            'venue_id': self.venue.id, 'artist_id': self.artist.id, 'start_time': start_time})
+
+    def test_overlapping_booking_is_rejected(self):
+        self.assertEqual(self.book('2035-05-21 20:00:00').status_code, 200)
+        self.assertEqual(self.book('2035-05-21 21:00:00').status_code, 409)
+        self.assertEqual(Show.query.count(), 1)
+
+    def test_booking_check_holds_the_write_lock(self):
+        other = create_engine(db.engine.url, connect_args={'timeout': 0})
+        with fyyur.app.test_request_context(method='POST'):
+            fyyur.lock_bookings()
+            with self.assertRaises(OperationalError):
+                other.execute(Show.__table__.insert(), venue_id=self.venue.id, artist_id=self.artist.id,
+                              start_time=datetime(2035, 5, 21, 20), end_time=datetime(2035, 5, 21, 22))
+            db.session.remove()
+        other.dispose()
+
+
+class ReplicaRoutingTestCase(FyyurTestCase):
+    """The replica has the same tables as the primary but other rows."""
+
+    def setUp(self):
+        FyyurTestCase.setUp(self)
+        fyyur.app.config['WTF_CSRF_ENABLED'] = False
+        self.replica = db.get_replica_engines(fyyur.app)[0]
+        db.metadata.drop_all(self.replica)
+        db.metadata.create_all(self.replica)
+        self.replica.execute(Venue.__table__.insert(), name='Replica Hall', city='Austin',
+                             state='TX', upcoming_shows_count=0, past_shows_count=0)
+        self.client = fyyur.app.test_client()
+
+    def tearDown(self):
+        db.metadata.drop_all(self.replica)
+        FyyurTestCase.tearDown(self)
+
+    def venue_names(self, engine):
+        return set(name for name, in engine.execute(Venue.__table__.select().with_only_columns([Venue.name])))
+
+    def create_venue(self, name):
+        return self.client.post('/venues/create', data={
+            'name': name, 'city': 'Austin', 'state': 'TX', 'address': '1 Main St',
+            'phone': '512-000-0000', 'genres': 'Jazz', 'facebook_link': '', 'image_link': '',
+            'website_link': '', 'seeking_description': ''})
+
+    def test_get_reads_replica(self):
+        res = self.client.get('/venues')
+        page = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Replica Hall', page)
+        self.assertNotIn('The Musical Hop', page)
+
+    def test_session_binds(self):
+        with fyyur.app.test_request_context(method='GET'):
+            self.assertIs(db.session.get_bind(), self.replica)
+            db.session.remove()
+        with fyyur.app.test_request_context(method='POST'):
+            self.assertIs(db.session.get_bind(), db.engine)
+            db.session.remove()
+
+    def test_write_goes_to_primary(self):
+        res = self.create_venue('Primary Lounge')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Primary Lounge', self.venue_names(db.engine))
+        self.assertNotIn('Primary Lounge', self.venue_names(self.replica))
+
+    def test_reads_stay_on_primary_after_write(self):
+        res = self.create_venue('Primary Lounge')
+        cookie = res.headers.get('Set-Cookie', '')
+        page = self.client.get('/venues').get_data(as_text=True)
+
+        self.assertIn(STICKY_COOKIE, cookie)
+        self.assertIn('Primary Lounge', page)
+        self.assertIn('The Musical Hop', page)
+        self.assertNotIn('Replica Hall', page)
+
+    def test_reads_return_to_replica_when_sticky_time_passed(self):
+        self.create_venue('Primary Lounge')
+        self.client.set_cookie('localhost', STICKY_COOKIE, '0')
+        page = self.client.get('/venues').get_data(as_text=True)
+
+        self.assertIn('Replica Hall', page)
+        self.assertNotIn('Primary Lounge', page)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,29 +1,60 @@
 import os
 from flask import Flask, request, abort, jsonify, flash
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from sqlalchemy import func
 from dotenv import load_dotenv
 from pathlib import Path
 import random
 import sys
 
-from models import setup_db, Question, Category, db
+from models import setup_db, Question, db, metadata_cache, search_questions
+from quiz_sessions import QuizSession, session_store, new_token
 
 QUESTIONS_PER_PAGE = 10
+QUIZ_SESSION_TTL = 3600
+QUIZ_SESSIONS_MAX = 10000
 
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
 def paginate_questions(request, selection):
-  page = request.args.get('page', 1, type=int)
-  start =  (page - 1) * QUESTIONS_PER_PAGE
-  end = start + QUESTIONS_PER_PAGE
-
-  questions = [question.format() for question in selection]
-  current_questions = questions[start:end]
-
-  return current_questions
+  """Return one page of a question query and the after_id of the next page.
+
+  The page is cut out by the database: with ?after_id=<id> it holds the
+  questions after that id (a keyset, for deep paging), otherwise page
+  ?page=<n> is read with LIMIT/OFFSET. The next after_id is None on the
+  last page.
+  """
+  selection = selection.order_by(Question.id)
+  after_id = request.args.get('after_id', type=int)
+  if after_id is not None:
+    selection = selection.filter(Question.id > after_id)
+  else:
+    page = max(request.args.get('page', 1, type=int), 1)
+    selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+  questions = selection.limit(QUESTIONS_PER_PAGE + 1).all()
+
+  current_questions = [question.format() for question in questions[:QUESTIONS_PER_PAGE]]
+  next_after_id = None
+  if len(questions) > QUESTIONS_PER_PAGE:
+    next_after_id = current_questions[-1]['id']
+
+  return current_questions, next_after_id
+
+def choose_question(question_ids, seen, draws=8):
+  """Return a random id of ``question_ids`` that is not in the set ``seen``, or None.
+
+  Draws at random until an unseen id comes up, which takes O(1) expected
+  draws while most ids are unseen; after ``draws`` misses the few unseen
+  ids are collected and one of them is picked.
+  """
+  if not question_ids:
+    return None
+  for _ in range(draws):
+    question_id = random.choice(question_ids)
+    if question_id not in seen:
+      return question_id
+  unseen = [question_id for question_id in question_ids if question_id not in seen]
+  return random.choice(unseen) if unseen else None
 
 def create_app(test_config=None):
   # create and configure the app
@@ -31,6 +62,7 @@ def create_app(test_config=None):
   setup_db(app)
   CORS(app, resources={r"/api/*": {'origins': '*'}})
   app.secret_key = os.getenv('SECRET_KEY')
+  quiz_sessions = session_store(QUIZ_SESSIONS_MAX, QUIZ_SESSION_TTL)
 
   @app.after_request
   def after_request(response):
@@ -41,26 +73,16 @@ def create_app(test_config=None):
   @app.route('/categories', methods=['GET'])
   def retrieve_categories():
 
-    categories = Category.query.all()
-    formatted_categories = {}
-    for category in categories:
-      formatted_categories[category.id] = category.type
-
     return jsonify({
       'success': True,
-      'categories': formatted_categories
+      'categories': metadata_cache.get()['categories']
     })
 
   @app.route('/questions', methods=['GET'])
   def retrieve_questions_page():
 
-    selection = Question.query.order_by(Question.id).all()
-    current_questions = paginate_questions(request, selection)
-
-    categories = Category.query.all()
-    formatted_categories = {}
-    for category in categories:
-      formatted_categories[category.id] = category.type
+    current_questions, next_after_id = paginate_questions(request, Question.query)
+    metadata = metadata_cache.get()
 
     if len(current_questions) == 0:
       abort(404)
@@ -68,9 +90,10 @@ def create_app(test_config=None):
     return jsonify({
       'success': True,
       'questions': current_questions,
-      'total_questions': len(Question.query.all()),
-      'categories': formatted_categories,
-      'current_category': None
+      'total_questions': metadata['total_questions'],
+      'categories': metadata['categories'],
+      'current_category': None,
+      'next_after_id': next_after_id
     })
   
   @app.route('/questions', methods=['POST'])
@@ -129,24 +152,31 @@ def create_app(test_config=None):
 
   @app.route('/questions/search', methods=['POST'])
   def search_for_questions():
-    
-    body = request.get_json()
-    search_term = body.get('searchTerm')
-    response = Question.query.filter(Question.question.ilike('%{}%'.format(search_term))).all()
-    current_responses = paginate_questions(request, response)
+    body = request.get_json() or {}
+    try:
+      category = body.get('category')
+      category = int(category) or None if category is not None else None
+      difficulty = body.get('difficulty')
+      difficulty = None if difficulty is None else int(difficulty)
+    except (TypeError, ValueError):
+      abort(422)
+    page = max(request.args.get('page', 1, type=int), 1)
+    questions, total, next_after_id = search_questions(body.get('searchTerm'), category, difficulty,
+      (page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE, request.args.get('after_id', type=int))
 
     return jsonify({
       "success": True,
-      "questions": current_responses,
-      "total_questions": len(Question.query.all()),
-      "current_category": None
+      "questions": questions,
+      "total_questions": total,
+      "current_category": category,
+      "next_after_id": next_after_id
     })
 
   @app.route('/categories/<int:category_id>/questions', methods=['GET'])
   def retrieve_questions_based_on_categoy(category_id):
 
-    selection = Question.query.filter(Question.category == category_id).all()
-    current_questions = paginate_questions(request, selection)
+    selection = Question.query.filter(Question.category == category_id)
+    current_questions, next_after_id = paginate_questions(request, selection)
 
     if len(current_questions) == 0:
       abort(404)
@@ -154,36 +184,73 @@ def create_app(test_config=None):
     return jsonify({
       'success': True,
       'questions': current_questions,
-      'total_questions': len(Question.query.all()),
-      'current_category': category_id
+      'total_questions': metadata_cache.get()['category_counts'].get(str(category_id), 0),
+      'current_category': category_id,
+      'next_after_id': next_after_id
     })
 
   @app.route('/quizzes', methods=['POST'])
   def play_quiz():
     try:
       body = request.get_json()
-      previous_questions = body.get("previous_questions", [])
+      previous_questions = set(body.get("previous_questions", []))
       quiz_category = body.get("quiz_category", None)
       category_id = int(quiz_category["id"])
-      if quiz_category:
-          if quiz_category["id"] == 0:
-              quiz = Question.query.all()
-          else:
-              quiz = Question.query.filter_by(category=category_id).all()
-      if not quiz:
+      question_ids = metadata_cache.get()['question_ids'].get(
+        None if category_id == 0 else str(category_id))
+      if not question_ids:
           return abort(422)
-      selected = []
-      for question in quiz:
-          if question.id not in previous_questions:
-              selected.append(question.format())
-      if len(selected) != 0:
-          result = random.choice(selected)
-          return jsonify({"success": True, "question": result})
+      question_id = choose_question(question_ids, previous_questions)
+      question = Question.query.get(question_id) if question_id is not None else None
+      if question is not None:
+          return jsonify({"success": True, "question": question.format()})
       else:
           return jsonify({"success": True, "question": False})
     except:
         abort(422)
 
+  @app.route('/quizzes/sessions', methods=['POST'])
+  def start_quiz_session():
+    try:
+      body = request.get_json()
+      category_id = int(body["quiz_category"]["id"])
+    except:
+      abort(422)
+    category = None if category_id == 0 else str(category_id)
+    question_ids = metadata_cache.get()['question_ids'].get(category)
+    if not question_ids:
+      abort(422)
+    token = new_token()
+    quiz_sessions.set(token, QuizSession(category).encode())
+    return jsonify({
+      'success': True,
+      'token': token,
+      'total_questions': len(question_ids)
+    })
+
+  @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+  def next_quiz_question(token):
+    data = quiz_sessions.get(token)
+    if data is None:
+      abort(404)
+    session = QuizSession.decode(data)
+    question_ids = metadata_cache.get()['question_ids'].get(session.category, ())
+    question_id = choose_question(question_ids, session.seen)
+    question = Question.query.get(question_id) if question_id is not None else None
+    if question is not None:
+      session.seen.add(question.id)
+    quiz_sessions.set(token, session.encode())
+    return jsonify({
+      'success': True,
+      'question': question.format() if question is not None else False,
+      'questions_asked': len(session.seen)
+    })
+
+  @app.route('/quizzes/sessions/<token>', methods=['DELETE'])
+  def end_quiz_session(token):
+    quiz_sessions.delete(token)
+    return jsonify({'success': True})
+
   @app.errorhandler(400)
   def bad_request(error):
     return jsonify({
@@ -0,0 +1,122 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+'''
+Bitset
+    set of small non-negative integers, one bit each; the ids of the
+    questions a quiz session has asked
+'''
+class Bitset(object):
+
+  def __init__(self, data=b''):
+    self.bits = bytearray(data)
+
+  def add(self, value):
+    index = value >> 3
+    if index >= len(self.bits):
+      self.bits.extend(bytes(index + 1 - len(self.bits)))
+    self.bits[index] |= 1 << (value & 7)
+
+  def __contains__(self, value):
+    index = value >> 3
+    return 0 <= index < len(self.bits) and bool(self.bits[index] & (1 << (value & 7)))
+
+  def __len__(self):
+    return sum(bin(byte).count('1') for byte in self.bits)
+
+  def to_bytes(self):
+    return bytes(self.bits)
+
+'''
+QuizSession
+    category played (None for all) and the questions asked so far
+'''
+class QuizSession(object):
+
+  def __init__(self, category, seen=None):
+    self.category = category
+    self.seen = seen or Bitset()
+
+  def encode(self):
+    return (self.category or '').encode() + b':' + self.seen.to_bytes()
+
+  @classmethod
+  def decode(cls, data):
+    category, seen = data.split(b':', 1)
+    return cls(category.decode() or None, Bitset(seen))
+
+'''
+MemorySessionStore
+    encoded sessions kept in this process; sessions expire ttl seconds after
+    their last use and the least recently used one is evicted once
+    max_sessions are stored
+'''
+class MemorySessionStore(object):
+
+  def __init__(self, max_sessions=10000, ttl=3600):
+    self.max_sessions = max_sessions
+    self.ttl = ttl
+    self._sessions = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, token):
+    with self._lock:
+      entry = self._sessions.get(token)
+      if entry is None:
+        return None
+      expires_at, data = entry
+      if expires_at <= time.monotonic():
+        del self._sessions[token]
+        return None
+      self._sessions.move_to_end(token)
+      return data
+
+  def set(self, token, data):
+    with self._lock:
+      self._sessions.pop(token, None)
+      while len(self._sessions) >= self.max_sessions:
+        self._sessions.popitem(last=False)
+      self._sessions[token] = (time.monotonic() + self.ttl, data)
+
+  def delete(self, token):
+    with self._lock:
+      self._sessions.pop(token, None)
+
+'''
+RedisSessionStore
+    encoded sessions kept in Redis, shared by all workers; takes a
+    redis-py client
+'''
+class RedisSessionStore(object):
+
+  def __init__(self, client, ttl=3600, prefix='trivia:quiz:'):
+    self.client = client
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def get(self, token):
+    return self.client.get(self.prefix + token)
+
+  def set(self, token, data):
+    self.client.setex(self.prefix + token, self.ttl, data)
+
+  def delete(self, token):
+    self.client.delete(self.prefix + token)
+
+'''
+session_store(max_sessions, ttl)
+    a RedisSessionStore if QUIZ_SESSION_REDIS_URL is set (redis-py has to
+    be installed then), else a MemorySessionStore
+'''
+def session_store(max_sessions, ttl):
+  redis_url = os.getenv('QUIZ_SESSION_REDIS_URL')
+  if redis_url:
+    import redis
+    return RedisSessionStore(redis.Redis.from_url(redis_url), ttl)
+  return MemorySessionStore(max_sessions, ttl)
+
+def new_token():
+  return secrets.token_urlsafe(16)
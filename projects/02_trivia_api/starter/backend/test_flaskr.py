@@ -4,7 +4,7 @@ import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, Question, Category, MetadataVersion, db, search_questions_by_substring
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -68,6 +68,36 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['categories'])
         self.assertEqual(data['current_category'], None)
 
+    def test_get_questions_after_id(self):
+        first_page = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?after_id={}'.format(first_page['next_after_id']))
+        data  = json.loads(res.data)
+
+        first_ids = [question['id'] for question in first_page['questions']]
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(ids)
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(min(ids) > max(first_ids))
+
+    def test_get_questions_page_matches_after_id(self):
+        first_page = json.loads(self.client().get('/questions?page=1').data)
+        by_page = json.loads(self.client().get('/questions?page=2').data)
+        by_after_id = json.loads(self.client().get(
+            '/questions?after_id={}'.format(first_page['next_after_id'])).data)
+
+        self.assertEqual(by_page['questions'], by_after_id['questions'])
+        self.assertEqual(by_page['next_after_id'], by_after_id['next_after_id'])
+
+    def test_404_get_questions_after_last_id(self):
+        last = Question.query.order_by(self.db.desc(Question.id)).first()
+        res = self.client().get('/questions?after_id={}'.format(last.id))
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_404_get_questions_above_limit(self):
         res = self.client().get('/questions?page=1000')
         data  = json.loads(res.data)
@@ -113,6 +143,36 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['deleted'], delete_id)
         self.assertEqual(question, None)
 
+    def test_total_questions_follow_insert_and_delete(self):
+        before = json.loads(self.client().get('/questions').data)['total_questions']
+        in_category = json.loads(self.client().get('/categories/5/questions').data)['total_questions']
+
+        question = Question(question='Count-Question', answer='Count-Answer', category=5, difficulty=1)
+        question.insert()
+        after_insert = json.loads(self.client().get('/questions').data)['total_questions']
+        category_after_insert = json.loads(self.client().get('/categories/5/questions').data)['total_questions']
+        question.delete()
+        after_delete = json.loads(self.client().get('/questions').data)['total_questions']
+
+        self.assertEqual(after_insert, before + 1)
+        self.assertEqual(category_after_insert, in_category + 1)
+        self.assertEqual(after_delete, before)
+
+    def test_total_questions_reloaded_after_other_worker_change(self):
+        before = json.loads(self.client().get('/questions').data)['total_questions']
+
+        # another worker inserting a question only changes the database
+        db.session.execute(Question.__table__.insert().values(
+            question='Worker-Question', answer='Worker-Answer', category='5', difficulty=1))
+        db.session.query(MetadataVersion).update({MetadataVersion.version: MetadataVersion.version + 1})
+        db.session.commit()
+        after = json.loads(self.client().get('/questions').data)['total_questions']
+        Question.query.filter(Question.question == 'Worker-Question').delete()
+        db.session.query(MetadataVersion).update({MetadataVersion.version: MetadataVersion.version + 1})
+        db.session.commit()
+
+        self.assertEqual(after, before + 1)
+
     def test_404_delete_questions_above_limit(self):
         res = self.client().delete('/questions/1000')
         data  = json.loads(res.data)
@@ -131,6 +191,84 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(data['current_category'], None)
 
+    def test_post_search_matches_answers(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'Washington'})
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], len(data['questions']))
+        question = [question for question in data['questions'] if question['id'] == 12][0]
+        self.assertIn('<mark>Washington</mark>', question['answer_highlight'])
+
+    def test_post_search_ranks_question_text_first(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'tom'})
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in data['questions']], [2, 4])
+        self.assertIn('<mark>Tom</mark>', data['questions'][0]['question_highlight'])
+
+    def test_post_search_matches_word_prefixes(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'paint'})
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(question['id'] for question in data['questions']), [18, 19])
+
+    def test_post_search_filters(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'soccer', 'category': 6, 'difficulty': 4})
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in data['questions']], [11])
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['current_category'], 6)
+
+    def test_post_search_pages(self):
+        questions = [Question('Zebrafish question {}'.format(number), 'Zebrafish', '1', 1)
+                     for number in range(25)]
+        for question in questions:
+            question.insert()
+        ids = set(question.id for question in questions)
+        try:
+            pages = []
+            for page in (1, 2, 3):
+                res = self.client().post('/questions/search?page={}'.format(page), json={'searchTerm': 'zebrafish'})
+                pages.append(json.loads(res.data))
+            after_id, keyset_ids = None, []
+            while True:
+                url = '/questions/search' + ('?after_id={}'.format(after_id) if after_id else '')
+                data = json.loads(self.client().post(url, json={'searchTerm': 'zebrafish'}).data)
+                keyset_ids.extend(question['id'] for question in data['questions'])
+                after_id = data['next_after_id']
+                if after_id is None:
+                    break
+        finally:
+            for question in questions:
+                question.delete()
+
+        self.assertEqual([len(data['questions']) for data in pages], [10, 10, 5])
+        self.assertEqual([data['total_questions'] for data in pages], [25, 25, 25])
+        self.assertEqual(set(question['id'] for data in pages for question in data['questions']), ids)
+        self.assertEqual(len(keyset_ids), 25)
+        self.assertEqual(set(keyset_ids), ids)
+
+    def test_search_questions_by_substring(self):
+        with self.app.app_context():
+            questions, total, next_after_id = search_questions_by_substring('Soccer world', None, 4, 0, 10, None)
+
+        self.assertEqual([question['id'] for question in questions], [11])
+        self.assertEqual(total, 1)
+        self.assertIsNone(next_after_id)
+        self.assertIn('<mark>soccer World</mark>', questions[0]['question_highlight'])
+
+    def test_422_post_search_wrong_difficulty(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'soccer', 'difficulty': 'hard'})
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     def test_get_questions_based_on_categories(self):
         res = self.client().get('/categories/1/questions')
         data  = json.loads(res.data)
@@ -173,6 +311,82 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'request unprocessable')
 
+    def test_post_quizzes_skips_previous_questions(self):
+        ids = [question.id for question in Question.query.filter(Question.category == '1')]
+        res = self.client().post('/quizzes', json={
+            'previous_questions': ids[1:],
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], ids[0])
+
+    def test_post_quizzes_all_questions_seen(self):
+        ids = [question.id for question in Question.query.filter(Question.category == '1')]
+        res = self.client().post('/quizzes', json={
+            'previous_questions': ids,
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question'], False)
+
+    def test_post_quizzes_all_categories(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 0, 'type': 'click'}
+        })
+        data  = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['question'])
+
+    def test_quiz_session_asks_each_question_once(self):
+        ids = [question.id for question in Question.query.filter(Question.category == '1')]
+        res = self.client().post('/quizzes/sessions', json=self.quizz_request)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], len(ids))
+
+        asked = []
+        for _ in ids:
+            res = self.client().post('/quizzes/sessions/{}/next'.format(data['token']))
+            asked.append(json.loads(res.data)['question']['id'])
+        res = self.client().post('/quizzes/sessions/{}/next'.format(data['token']))
+        last = json.loads(res.data)
+
+        self.assertEqual(sorted(asked), sorted(ids))
+        self.assertEqual(last['question'], False)
+        self.assertEqual(last['questions_asked'], len(ids))
+
+    def test_404_quiz_session_unknown_token(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_404_quiz_session_after_end(self):
+        res = self.client().post('/quizzes/sessions', json=self.quizz_request)
+        token = json.loads(res.data)['token']
+        self.client().delete('/quizzes/sessions/{}'.format(token))
+        res = self.client().post('/quizzes/sessions/{}/next'.format(token))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_422_quiz_session_without_category(self):
+        res = self.client().post('/quizzes/sessions', json={})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
 
 # Make the tests conveniently executable
 if __name__ == "__main__":